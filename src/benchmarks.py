@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Rendering benchmarks.
+
+Runs fixed scenarios against a MockScreen and an AnsiScreen writing to a
+NullSink, and reports the best and mean time per run, the peak memory
+traced during a run and the number of memory blocks left allocated by it.
+
+    ./benchmarks.py                           # run everything
+    ./benchmarks.py pager layout              # run scenarios by name prefix
+    ./benchmarks.py --save base.json          # record results
+    ./benchmarks.py --compare base.json       # flag regressions against them
+    ./benchmarks.py --profile layout          # show which widgets are expensive
+    ./benchmarks.py --footprint               # show memory taken per widget
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from tulip import *
+
+ROWS = 60
+COLS = 200
+
+SCENARIOS = []
+
+def scenario(f):
+    SCENARIOS.append(f)
+    return f
+
+def make_screens():
+    return [('mock', MockScreen(ROWS, COLS)), ('ansi', AnsiScreen(ROWS, COLS, NullSink()))]
+
+def frame(screen, root, i=0):
+    def run():
+        screen.clear()
+        root.render(screen, 0, 0, i, 0, screen.nrows, screen.ncols)
+        if isinstance(screen, AnsiScreen):
+            screen.render()
+    return run
+
+@scenario
+def nesting(screen):
+    """HContainers and VContainers nested 60 levels deep.
+    """
+
+    leaf = Text('leaf')
+    root = leaf
+    for depth in range(60):
+        cont = HContainer if depth % 2 else VContainer
+        root = cont([Text('d{}'.format(depth)), root, Text('.')])
+    yield 'render', frame(screen, root)
+
+    def measure():
+        leaf.set_text('leaf')
+        leaf.invalidate()
+        root.size
+    yield 'measure', measure
+
+@scenario
+def wide(screen):
+    """Changing one Text in a VContainer of 10k rows.
+    """
+
+    rows = [HContainer([Text('cell {}'.format(k)) for k in range(5)]) for n in range(10000)]
+    root = VContainer(rows)
+    root.size
+    leaf = rows[5000]._children[2]
+    def measure():
+        for n in range(10):
+            leaf.set_text('changed ' * (n % 3))
+            root.size
+    yield 'measure', measure
+
+@scenario
+def pager(screen):
+    """A Pager with 100k children scrolled to various pages.
+    """
+
+    pager = Pager([Text('message {:06}'.format(n)) for n in range(100000)])
+    pager.render(screen, 0, 0, 0, 0, ROWS, COLS)
+    for page in (1, pager.num_pages() // 2, pager.num_pages()):
+        def run(page=page):
+            pager.vscroll = (page - 1) * ROWS
+            frame(screen, pager)()
+        yield 'page-{}'.format(page), run
+
+@scenario
+def unicode(screen):
+    """A VContainer of wide (CJK), accented and ASCII lines, scrolled sideways.
+    """
+
+    words = ['\u6f22\u5b57\u304b\u306a', 'cafe\u0301', 'plain']
+    root = VContainer([Text(' '.join(words[(n + k) % 3] for k in range(20)) + str(n)) for n in range(ROWS)])
+    root.size
+    for j in (0, 7):
+        def run(j=j):
+            screen.clear()
+            root.render(screen, 0, 0, 0, j, screen.nrows, screen.ncols)
+            if isinstance(screen, AnsiScreen):
+                screen.render()
+        yield 'scroll-{}'.format(j), run
+
+@scenario
+def stream(screen):
+    """A StreamPager following 50k lines arriving between frames.
+    """
+
+    pager = StreamPager(max_lines=10000)
+    pager.render(screen, 0, 0, 0, 0, ROWS, COLS)
+    lines = ['log line {:06} '.format(n) * 4 for n in range(50000)]
+    def run():
+        pager.extend(lines)
+        pager.repaint()
+        if isinstance(screen, AnsiScreen):
+            screen.render()
+    yield 'append-50k', run
+
+@scenario
+def layout(screen):
+    """A ColumnLayout with 10k rows of weighted cells.
+    """
+
+    layout = ColumnLayout()
+    layout.add_cell(Cell(min_width=4))
+    layout.add_cell(Cell(weight=2))
+    layout.add_cell(Cell(weight=1, halign=HAlign.RIGHT))
+    for n in range(10000):
+        layout.add_child(Row([Text(str(n)), Text('subject ' * (n % 5)), Text('author')]))
+    yield 'top', frame(screen, layout)
+    yield 'bottom', frame(screen, layout, 10000 - ROWS)
+
+    # the widths of the cells differ from page to page
+    paged = ColumnLayout()
+    paged.add_cell(Cell())
+    paged.add_cell(Cell())
+    for n in range(10000):
+        paged.add_child(Row([Text('x' * (1 + n // ROWS % 20)), Text('author')]))
+    page = [0]
+    def paging():
+        page[0] = (page[0] + 1) % (10000 // ROWS)
+        frame(screen, paged, page[0] * ROWS)()
+    yield 'paging', paging
+
+@scenario
+def paragraph(screen):
+    """Reflowing a long Paragraph at varying widths.
+    """
+
+    text = '\n'.join('lorem ipsum dolor sit amet ' * (1 + n % 7) for n in range(500))
+    par = Paragraph(text)
+    widths = [40, 80, 120, 200]
+    def reflow():
+        for cols in widths:
+            screen.clear()
+            par.render(screen, 0, 0, 0, 0, ROWS, cols)
+    yield 'reflow', reflow
+    yield 'same-width', frame(screen, par)
+
+@scenario
+def full_frame(screen):
+    """Rendering whole frames of styled rows which don't change between frames.
+    """
+
+    def styled_row(n):
+        row = HContainer([Text('{:4}'.format(n)), Text(' subject {} '.format(n) * 3), Text('author')])
+        row.add_class('bluebg' if n % 2 else 'tags')
+        row._children[1].add_class('subject')
+        return row
+    rows = VContainer([styled_row(n) for n in range(ROWS)])
+    yield 'rows', frame(screen, rows)
+
+    # rows nested in boxes, so most cells are put over by several layers
+    boxes = rows
+    for depth in range(4):
+        boxes = HContainer([VContainer([Text('|') for _ in range(ROWS)]), boxes])
+        boxes.add_class('qgroup')
+    yield 'boxes', frame(screen, boxes)
+
+@scenario
+def focus(screen):
+    """Walking through focusable widgets scattered among decorations.
+    """
+
+    items = []
+    for n in range(200):
+        row = HContainer([Text('*'), Text('item {}'.format(n)), Text(' ' * 3), Text('|')])
+        row._children[1].focusable = True
+        items.append(row)
+    root = VContainer(items)
+    first = root.first_focusable()
+    def walk():
+        w = first
+        while w:
+            w = w.next_focusable()
+    yield 'next-focusable', walk
+
+    def jump():
+        w = first
+        for _ in range(20):
+            w = w.jump_focusable(10)
+    yield 'jump-focusable', jump
+
+FOOTPRINTS = [
+    ('Text', lambda: Text('x')),
+    ('Air', lambda: Air(1, 1)),
+    ('HContainer of 3 Texts', lambda: HContainer([Text('a'), Text('b'), Text('c')])),
+    ('Row of 3 Texts', lambda: Row([Text('a'), Text('b'), Text('c')])),
+]
+
+def footprint(n=100000):
+    """Prints the memory taken by one widget (including its children) of each kind.
+    """
+
+    print('{:32} {:>10}'.format('widget', 'bytes'))
+    for name, make in FOOTPRINTS:
+        widgets = [None] * n
+        tracemalloc.start()
+        for k in range(n):
+            widgets[k] = make()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{:32} {:10.1f}'.format(name, current / n))
+        del widgets
+
+def measure(run, repeat):
+    run()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'best_ms': 1000 * min(times),
+        'mean_ms': 1000 * sum(times) / len(times),
+        'peak_kib': peak / 1024,
+        'blocks': sys.getallocatedblocks() - blocks,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Run rendering benchmarks.')
+    parser.add_argument('scenarios', nargs='*', help='names (prefixes) of scenarios to run')
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE', help='save results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='compare with results saved earlier')
+    parser.add_argument('--threshold', type=float, default=1.2,
+        help='slowdown (best time ratio) reported as a regression')
+    parser.add_argument('--profile', action='store_true',
+        help='print a per-widget profile of one run of each benchmark')
+    parser.add_argument('--footprint', action='store_true',
+        help='print the memory taken per widget instead of running benchmarks')
+    args = parser.parse_args()
+
+    if args.footprint:
+        footprint()
+        return 0
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = 0
+    print('{:32} {:>10} {:>10} {:>10} {:>8}'.format('benchmark', 'best ms', 'mean ms', 'peak KiB', 'blocks'))
+    for f in SCENARIOS:
+        if args.scenarios and not any(f.__name__.startswith(s) for s in args.scenarios):
+            continue
+        for screen_name, screen in make_screens():
+            for case, run in f(screen):
+                name = '{}/{}/{}'.format(f.__name__, case, screen_name)
+                r = results[name] = measure(run, args.repeat)
+                line = '{:32} {best_ms:10.3f} {mean_ms:10.3f} {peak_kib:10.1f} {blocks:8}'.format(name, **r)
+                if name in baseline:
+                    ratio = r['best_ms'] / max(baseline[name]['best_ms'], 1e-6)
+                    line += '  x{:.2f}'.format(ratio)
+                    if ratio > args.threshold:
+                        line += ' REGRESSION'
+                        regressions += 1
+                print(line)
+                if args.profile:
+                    with Profiler() as p:
+                        run()
+                    p.report(limit=5, instances=False)
+                    print()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
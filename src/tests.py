@@ -1,6 +1,17 @@
+import asyncio
+import io
+import os
+import tempfile
+import threading
 import unittest
 from tulip import *
 from tulip.layout import Viewport, VAlign, HAlign
+from tulip.text import wrap
+from tulip.width import clip, text_width
+from tulip.screen import Ansi256, TrueColor, ColorName, AnsiFormat, Theme
+from tulip.grid import CellGrid, WIDE_TAIL
+from tulip import widget as widget_module
+from tulip.input import collapse
 
 class SoupUITestCase(unittest.TestCase):
     def assertScreenContent(self, screen, rows):
@@ -34,6 +45,95 @@ class TextTest(SoupUITestCase):
         self.assertEqual(text.render(screen, 0, 0, 0, 4, 1, 1), (1, 1))
         self.assertScreenContent(screen, ['o'])
 
+class ParagraphTest(SoupUITestCase):
+    def test_wrap(self):
+        self.assertEqual(wrap('hello world', 20), ['hello world'])
+        self.assertEqual(wrap('the quick brown fox', 9), ['the quick', '\u21B3brown', '\u21B3fox'])
+        self.assertEqual(wrap('abcdefghij', 4), ['abcd', '\u21B3efg', '\u21B3hij'])
+
+    def test_reflow(self):
+        par = Paragraph('the quick brown fox\njumps')
+        screen = MockScreen(5, 9)
+        self.assertEqual(par.render(screen, 0, 0, 0, 0, 5, 9), (4, 9))
+        self.assertScreenContent(screen, ['the quick', '\u21B3brown', '\u21B3fox', 'jumps'])
+        children = list(par._children)
+        par.render(screen, 0, 0, 0, 0, 5, 9)
+        self.assertEqual(children, par._children)
+
+        par.append(' over the dog')
+        self.assertEqual(par.text, 'the quick brown fox\njumps over the dog')
+        self.assertEqual(children[:3], par._children[:3])
+        par.render(screen, 0, 0, 0, 0, 5, 9)
+        self.assertScreenContent(screen, ['the quick', '\u21B3brown', '\u21B3fox', 'jumps', '\u21B3over the'])
+
+        par.text = 'short'
+        self.assertEqual(par.size, (1, 5))
+
+    def test_shrink_focus(self):
+        par = Paragraph('one\ntwo\nthree')
+        root = VContainer([Text('above'), par])
+        for w in par._children:
+            w.focusable = True
+        last = par._children[-1]
+        last.focus()
+        self.assertIs(root.focused_leaf(), last)
+
+        par.text = 'one'
+        self.assertIsNone(last.parent)
+        self.assertIsNone(last._position)
+        self.assertIs(root.focused_leaf(), par)
+        self.assertEqual(par._children[0].next_focusable(), None)
+        self.assertEqual(root._focusable_count, 1)
+
+class WidthTest(SoupUITestCase):
+    def test_measure(self):
+        self.assertEqual(text_width('hello'), 5)
+        self.assertEqual(text_width('\u4e2d\u6587'), 4)
+        self.assertEqual(text_width('e\u0301'), 1)
+        self.assertEqual(text_width('\U0001F468\u200d\U0001F469'), 2)
+        self.assertEqual(Text('\u4e2d\u6587!').size, (1, 5))
+
+    def test_clip(self):
+        self.assertEqual(clip('a\u4e2d\u6587b', 1, 4), '\u4e2d\u6587')
+        self.assertEqual(clip('a\u4e2d\u6587b', 2, 4), ' \u6587b')
+        self.assertEqual(clip('a\u4e2d\u6587b', 0, 2), 'a ')
+        self.assertEqual(clip('e\u0301x', 0, 1), 'e\u0301')
+
+    def test_render(self):
+        screen = MockScreen(1, 10)
+        text = Text('a\u4e2d\u6587b')
+        self.assertEqual(text.render(screen, 0, 0, 0, 0, 1, 10), (1, 6))
+        self.assertScreenContent(screen, ['a\u4e2d\u6587b'])
+        self.assertEqual(text.render(screen, 0, 0, 0, 2, 1, 3), (1, 3))
+        self.assertScreenContent(screen, [' \u6587'])
+        self.assertEqual(wrap('\u4e2d\u6587\u4e2d\u6587\u4e2d', 5), ['\u4e2d\u6587', '\u21B3\u4e2d\u6587', '\u21B3\u4e2d'])
+
+    def test_overwrite_half(self):
+        grid = CellGrid(1, 6, ord(' '))
+        grid.put(0, 0, '\u4e2d\u6587\u4e2d', 0, 0)
+        grid.put(0, 1, 'x', 0, 0)
+        grid.put(0, 4, 'y', 0, 0)
+        self.assertEqual(grid.text(0, 0, 6), ' x\u6587y ')
+
+    def test_occluded_half(self):
+        grid = CellGrid(1, 12, ord(' '))
+        grid.put(0, 11, 'q', 0, 3)
+        grid.put(0, 4, 'p', 0, 3)
+        grid.put(0, 10, '\u4e2d', 0, 1)
+        grid.put(0, 3, '\u4e2d\u6587', 0, 1)
+        self.assertEqual(grid.text(0, 0, 12), '    p\u6587    q')
+        self.assertEqual(grid.chars.count(WIDE_TAIL), 1)
+
+    def test_column_layout(self):
+        layout = ColumnLayout()
+        layout.add_cell(Cell())
+        layout.add_cell(Cell())
+        layout.add_child(Row([Text('\u4e2d\u6587'), Text('1')]))
+        layout.add_child(Row([Text('ab'), Text('2')]))
+        screen = MockScreen(2, 10)
+        self.assertEqual(layout.render(screen, 0, 0, 0, 0, 2, 10), (2, 5))
+        self.assertScreenContent(screen, ['\u4e2d\u65871', 'ab  2'])
+
 class FixedSizeWidget(Widget):
     @property
     def _measure(self):
@@ -110,6 +210,376 @@ class VContainerTest(SoupUITestCase):
         self.assertEqual(vcont.render(screen, 0, 0, 0, 3, 4, 10), (2, 3))
         self.assertScreenContent(screen, ['bbb', 'dd'])
 
+class ContainerIndexTest(SoupUITestCase):
+    def test_render_far_offset(self):
+        vcont = VContainer([Text('line {}'.format(n)) for n in range(10000)])
+        screen = MockScreen(2, 10)
+        self.assertEqual(vcont.render(screen, 0, 0, 9998, 0, 2, 10), (2, 9))
+        self.assertEqual(vcont.visible_start, 9998)
+        self.assertScreenContent(screen, ['line 9998', 'line 9999'])
+
+    def test_child_changes(self):
+        a, b = Text('a'), Text('b')
+        vcont = VContainer([a, b])
+        screen = MockScreen(3, 10)
+        vcont.render(screen, 0, 0, 1, 0, 3, 10)
+        self.assertScreenContent(screen, ['b'])
+        a.set_text('')
+        vcont.add_child(Text('c'))
+        self.assertEqual(vcont.render(screen, 0, 0, 1, 0, 3, 10), (1, 1))
+        self.assertScreenContent(screen, ['c'])
+        self.assertEqual(vcont.child_offset(vcont._children[2]), (1, 0))
+        self.assertEqual(vcont.size, (2, 1))
+
+    def test_insert_remove(self):
+        a, b, c = Text('a'), Text('b'), Text('c')
+        vcont = VContainer([a, c])
+        screen = MockScreen(3, 10)
+        vcont.render(screen, 0, 0, 0, 0, 3, 10)
+        vcont.insert_child(1, b)
+        self.assertEqual([w.index() for w in (a, b, c)], [0, 1, 2])
+        self.assertIs(a.sibling(1), b)
+        vcont.render(screen, 0, 0, 0, 0, 3, 10)
+        self.assertScreenContent(screen, ['a', 'b', 'c'])
+        vcont.remove_child(a)
+        self.assertIsNone(a.parent)
+        self.assertEqual([w.index() for w in (b, c)], [0, 1])
+        self.assertRaises(ValueError, vcont.child_index, a)
+        screen.clear()
+        vcont.render(screen, 0, 0, 0, 0, 3, 10)
+        self.assertScreenContent(screen, ['b', 'c'])
+
+class FocusTest(SoupUITestCase):
+    def make_tree(self):
+        rows = []
+        for n in range(20):
+            row = HContainer([Text('*'), Text(str(n)), VContainer([Text('a'), Text('b')])])
+            rows.append(row)
+        root = VContainer(rows)
+        for k, w in enumerate(root.subtree()):
+            w.focusable = k % 3 == 0
+        return root
+
+    def test_walk(self):
+        root = self.make_tree()
+        expected = [w for w in root.subtree() if w.focusable]
+        self.assertEqual(root._focusable_count, len(expected))
+        w, walked = root.first_focusable(), []
+        while w:
+            walked.append(w)
+            w = w.next_focusable()
+        self.assertEqual(walked, expected)
+        w, walked = root.last_focusable(), []
+        while w:
+            walked.append(w)
+            w = w.prev_focusable()
+        self.assertEqual(walked, expected[::-1])
+        self.assertIs(expected[3].jump_focusable(5), expected[8])
+        self.assertIs(expected[3].jump_focusable(-5), expected[0])
+        self.assertIs(expected[3].jump_focusable(1000), expected[-1])
+
+    def test_changes(self):
+        root = self.make_tree()
+        row = root._children[4]
+        row.insert_child(0, Text('new'))
+        row._children[0].focusable = True
+        row.remove_child(row._children[3])
+        root._children[7].clear_children()
+        root._children[9].focusable = False
+        expected = [w for w in root.subtree() if w.focusable]
+        self.assertEqual(root._focusable_count, len(expected))
+        self.assertEqual([root._select_focusable(n) for n in range(len(expected))], expected)
+        self.assertIs(expected[4].next_focusable(), expected[5])
+
+class CountingText(Text):
+    def __init__(self, text):
+        super().__init__(text)
+        self.num_renders = 0
+
+    def _render(self, screen, y, x, i, j, rows, cols):
+        self.num_renders += 1
+        return super()._render(screen, y, x, i, j, rows, cols)
+
+class RepaintTest(SoupUITestCase):
+    def setUp(self):
+        self.texts = [CountingText('item {}'.format(n)) for n in range(5)]
+        self.root = VContainer([HContainer([Text('> '), t]) for t in self.texts])
+        self.screen = MockScreen(5, 10)
+        self.root.render(self.screen, 0, 0, 0, 0, 5, 10)
+
+    def renders(self):
+        return [t.num_renders for t in self.texts]
+
+    def test_focus_change(self):
+        self.texts[1].focus()
+        self.texts[3].focus()
+        self.root.repaint()
+        self.assertEqual(self.renders(), [1, 2, 1, 2, 1])
+        self.root.repaint()
+        self.assertEqual(self.renders(), [1, 2, 1, 2, 1])
+
+    def test_same_size_change(self):
+        self.texts[2].set_text('ITEM 2')
+        self.root.repaint()
+        self.assertEqual(self.renders(), [1, 1, 2, 1, 1])
+        self.assertEqual(self.screen.rows[2], '> ITEM 2')
+
+    def test_layout_change(self):
+        self.texts[1].set_text('x')
+        self.root._children[2].hide()
+        self.root.repaint()
+        self.assertScreenContent(self.screen, [
+            '> item 0',
+            '> x',
+            '> item 3',
+            '> item 4',
+        ])
+
+    def test_unrendered_change(self):
+        status = Text('')
+        root = VContainer([status, Text('a')])
+        screen = MockScreen(2, 10)
+        changes = []
+        screen.on_change = lambda: changes.append(True)
+        root.render(screen, 0, 0, 0, 0, 2, 10)
+        status.set_text('status!')
+        self.assertTrue(changes)
+        root.repaint()
+        self.assertScreenContent(screen, ['status!', 'a'])
+
+    def test_clear_forgets_invalidated(self):
+        for screen in (MockScreen(5, 10), AnsiScreen(5, 10, NullSink())):
+            for n in range(100):
+                screen.clear()
+                self.root.render(screen, 0, 0, 0, 0, 5, 10)
+                screen.render()
+                self.texts[n % 5].set_text('item {}'.format(n))
+            self.assertEqual(len(screen.invalidated), 1)
+
+    def nested_tree(self):
+        leaf = Text('x')
+        inner = VContainer([leaf])
+        root = VContainer([VContainer([Text('t'), inner]), Text('z')])
+        screen = MockScreen(4, 10)
+        root.render(screen, 0, 0, 0, 0, 4, 10)
+        return leaf, inner, root, screen
+
+    def test_empty_and_back(self):
+        leaf, inner, root, screen = self.nested_tree()
+        leaf.set_text('')
+        root.repaint()
+        self.assertEqual(screen.rows[0:2], ['t', 'z'])
+        leaf.set_text('x')
+        root.repaint()
+        self.assertScreenContent(screen, ['t', 'x', 'z'])
+
+    def test_hide_show(self):
+        leaf, inner, root, screen = self.nested_tree()
+        leaf.hide()
+        root.repaint()
+        leaf.show()
+        root.repaint()
+        self.assertEqual(screen.rows[0:3], ['t', 'x', 'z'])
+        inner.hide()
+        root.repaint()
+        self.assertEqual(screen.rows[0:2], ['t', 'z'])
+        inner.show()
+        root.repaint()
+        self.assertEqual(screen.rows[0:3], ['t', 'x', 'z'])
+        leaf.set_text('y')
+        root.repaint()
+        self.assertScreenContent(screen, ['t', 'y', 'z'])
+
+class ClassesTest(SoupUITestCase):
+    def test_resulting_classes(self):
+        leaf = Text('x').add_class('leaf')
+        inner = HContainer([leaf]).add_class('inner')
+        root = VContainer([inner])
+        self.assertEqual(leaf.resulting_classes, ('leaf', 'inner'))
+        self.assertIs(leaf.resulting_classes, leaf.resulting_classes)
+        root.add_class('root')
+        self.assertEqual(leaf.resulting_classes, ('leaf', 'inner', 'root'))
+        inner.remove_class('inner')
+        self.assertEqual(leaf.resulting_classes, ('leaf', 'root'))
+        self.assertIs(leaf.resulting_classes, Text('y').add_class('leaf').add_class('root').resulting_classes)
+
+    def test_forget_subtree_only(self):
+        left, right = Text('l'), Text('r')
+        lcont, rcont = HContainer([left]), HContainer([right])
+        root = VContainer([lcont, rcont])
+        cached = right.resulting_classes
+        lcont.add_class('x')
+        self.assertIs(right._resulting_classes, cached)
+        self.assertIsNone(left._resulting_classes)
+        self.assertEqual(left.resulting_classes, ('x',))
+        for n in range(5000):
+            Text('t').add_class('c{}'.format(n)).resulting_classes
+        self.assertLessEqual(len(widget_module._class_tuples), widget_module._CLASS_TUPLES_MAX + 1)
+
+class VirtualContainerTest(SoupUITestCase):
+    def test_render(self):
+        made = []
+        def make_widget(k):
+            made.append(k)
+            return Text('line {}'.format(k))
+        vcont = VirtualContainer(lambda: 10**7, make_widget, cache_size=4, cols=12)
+        self.assertEqual(vcont.size, (10**7, 12))
+        screen = MockScreen(3, 20)
+        self.assertEqual(vcont.render(screen, 0, 0, 5000000, 0, 3, 20), (3, 12))
+        self.assertScreenContent(screen, ['line 5000000', 'line 5000001', 'line 5000002'])
+        self.assertEqual(made, [5000000, 5000001, 5000002])
+        w = vcont.child(5000001)
+        self.assertEqual(w.index(), 5000001)
+        self.assertEqual(w.sibling(1).text, 'line 5000002')
+        vcont.render(screen, 0, 0, 0, 0, 3, 20)
+        self.assertEqual(len(vcont._materialized), 4)
+
+    def test_row_height(self):
+        vcont = VirtualContainer(lambda: 100, lambda k: VContainer([Text(str(k)), Text('-')]),
+            row_height=lambda k: 2)
+        screen = MockScreen(3, 20)
+        vcont.render(screen, 0, 0, 21, 0, 3, 20)
+        self.assertScreenContent(screen, ['-', '11', '-'])
+        self.assertEqual(vcont.child(50).offset_to(vcont), (100, 0))
+
+    def test_in_hcontainer(self):
+        vcont = VirtualContainer(lambda: 1000, lambda k: Text('item {}'.format(k)))
+        root = HContainer([vcont, Text('|x')])
+        screen = MockScreen(2, 20)
+        root.render(screen, 0, 0, 0, 0, 2, 20)
+        self.assertScreenContent(screen, ['item 0|x', 'item 1'])
+        self.assertEqual(len(vcont._materialized), VirtualContainer.MEASURE_ROWS)
+
+    def test_focus_and_subtree(self):
+        def make_widget(k):
+            w = Text('item {}'.format(k))
+            w.focusable = k % 2 == 0
+            return w
+        vcont = VirtualContainer(lambda: 10**6, make_widget, cache_size=3, cols=12)
+        root = VContainer([Text('top'), vcont])
+        for k in (10, 500000, 500002):
+            vcont.child(k)
+        first = vcont.child(10)
+        self.assertEqual(first.next_focusable().text, 'item 500000')
+        self.assertEqual(vcont.child(500002).prev_focusable().text, 'item 500000')
+        vcont.child(10)
+        vcont.child(500002)
+        vcont.child(11)  # evicts 500000, the least recently used
+        self.assertNotIn(500000, vcont._materialized)
+        self.assertEqual(first.next_focusable().text, 'item 500002')
+        self.assertEqual([w.text for w in root.subtree() if isinstance(w, Text)],
+            ['top', 'item 10', 'item 11', 'item 500002'])
+        self.assertEqual(len(vcont._materialized), 3)
+
+class ProfilerTest(SoupUITestCase):
+    def test_profile(self):
+        render = Text.__dict__['_render']
+        root = VContainer([Text('a'), Pager([Text('b'), Text('c')])])
+        screen = MockScreen(3, 10)
+        with Profiler() as p:
+            root.render(screen, 0, 0, 0, 0, 3, 10)
+            root.render(screen, 0, 0, 0, 0, 3, 10)
+        self.assertIs(Text.__dict__['_render'], render)
+        self.assertEqual(p.by_class['Text'].renders, 6)
+        self.assertEqual(p.by_class['Text'].puts, 6)
+        self.assertEqual(p.by_class['Pager'].renders, 2)
+        self.assertEqual(p.by_class['Pager'].measures, 1)
+        self.assertEqual(p.by_class['Text'].size_misses, 3) # measured once each
+        out = io.StringIO()
+        p.dump_stacks(out)
+        self.assertIn('VContainer;Pager;Text ', out.getvalue())
+
+class StreamPagerTest(SoupUITestCase):
+    def test_follow(self):
+        pager = StreamPager(max_lines=100)
+        screen = MockScreen(3, 10)
+        pager.render(screen, 0, 0, 0, 0, 3, 10)
+        pager.feed(b'line 0\nline 1\nli')
+        pager.feed('ne 2\n')
+        self.assertEqual(pager.repaint(), (3, 6))
+        self.assertScreenContent(screen, ['line 0', 'line 1', 'line 2'])
+        pager.extend('line {}'.format(n) for n in range(3, 1000))
+        self.assertEqual(len(pager), 100)
+        self.assertEqual(pager.line(0), 'line 900')
+        self.assertEqual(pager.size, (100, 8))
+        pager.repaint()
+        self.assertScreenContent(screen, ['line 997', 'line 998', 'line 999'])
+
+    def test_scroll(self):
+        pager = StreamPager(max_lines=10)
+        screen = MockScreen(3, 10)
+        pager.extend(str(n) for n in range(10))
+        pager.render(screen, 0, 0, 0, 0, 3, 10)
+        pager.prev_page(2)
+        self.assertFalse(pager.follow)
+        pager.repaint()
+        self.assertScreenContent(screen, ['1', '2', '3'])
+        pager.extend(['10', '11'])
+        pager.repaint()
+        self.assertScreenContent(screen, ['2', '3', '4'])
+        pager.next_page(5)
+        self.assertTrue(pager.follow)
+        pager.repaint()
+        self.assertScreenContent(screen, ['9', '10', '11'])
+
+class FileViewTest(SoupUITestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_render(self):
+        with open(self.path, 'wb') as f:
+            f.write(b''.join('line {}\n'.format(n).encode() for n in range(1000)))
+            f.write(b'x' * 100 + b'\r\n\xc3\xa9nd')
+        view = FileView(self.path)
+        steps = 0
+        while view.index_step(64):
+            steps += 1
+        self.assertGreater(steps, 10)
+        self.assertEqual(view.num_lines, 1002)
+        self.assertEqual(view.line(999), 'line 999')
+        self.assertEqual(view.line(1001), '\xe9nd')
+        screen = MockScreen(3, 10)
+        self.assertEqual(view.render(screen, 0, 0, 998, 2, 3, 10), (3, 10))
+        self.assertScreenContent(screen, ['ne 998', 'ne 999', 'xxxxxxxxxx'])
+        self.assertEqual(view.size, (1002, 100))
+
+        with open(self.path, 'ab') as f:
+            f.write(b' more\nlast\n')
+        view.refresh()
+        while view.index_step():
+            pass
+        self.assertEqual(view.num_lines, 1003)
+        self.assertEqual(view.line(1001), '\xe9nd more')
+        view.close()
+
+    def test_width_and_truncation(self):
+        with open(self.path, 'wb') as f:
+            f.write(b''.join('line {}\n'.format(n).encode() for n in range(100)))
+        view = FileView(self.path)
+        while view.index_step():
+            pass
+        root = HContainer([view, Text('|x')])
+        screen = MockScreen(2, 20)
+        root.render(screen, 0, 0, 0, 0, 2, 20)
+        self.assertScreenContent(screen, ['line 0|x', 'line 1'])
+
+        os.truncate(self.path, 0) # copytruncate
+        with open(self.path, 'ab') as f:
+            f.write(b'new\n')
+        view.refresh()
+        screen = MockScreen(2, 20)
+        view.render(screen, 0, 0, 98, 0, 2, 20)
+        self.assertScreenContent(screen, [])
+        while view.index_step():
+            pass
+        self.assertEqual(view.num_lines, 1)
+        self.assertEqual(view.line(0), 'new')
+        view.close()
+
 class ViewportTest(SoupUITestCase):
     def test_render(self):
         vp = Viewport(Text('abcdefg'), rows=4, cols=2)
@@ -144,6 +614,80 @@ class ColumnLayoutTest(SoupUITestCase):
             'hello5    6               7'
         ])
 
+    def test_rerender(self):
+        layout = ColumnLayout()
+        layout.add_cell(Cell())
+        layout.add_cell(Cell())
+        cell = Text('a')
+        row = Row([cell, Text('b')])
+        layout.add_child(row)
+        layout.add_child(Row([Text('cc'), Text('d')]))
+        screen = MockScreen(2, 10)
+        layout.render(screen, 0, 0, 0, 0, 2, 10)
+        self.assertScreenContent(screen, ['a b', 'ccd'])
+        viewports = list(row.rendered_widgets)
+
+        cell.set_text('aaa')
+        self.assertEqual(layout.render(screen, 0, 0, 0, 0, 2, 10), (2, 4))
+        self.assertScreenContent(screen, ['aaab', 'cc d'])
+        self.assertEqual(viewports, row.rendered_widgets)
+
+    def test_insert_remove_cells(self):
+        layout = ColumnLayout()
+        layout.add_cell(Cell())
+        layout.add_cell(Cell())
+        layout.add_cell(Cell())
+        row = Row([Text('a'), Text('ccc')])
+        layout.add_child(row)
+        layout.add_child(Row([Text('dd'), Text('e')]))
+        screen = MockScreen(2, 10)
+        layout.render(screen, 0, 0, 0, 0, 2, 10)
+        self.assertScreenContent(screen, ['a ccc', 'dde'])
+        row.insert_child(1, Text('bbbb'))
+        screen.clear()
+        layout.render(screen, 0, 0, 0, 0, 2, 10)
+        self.assertScreenContent(screen, ['a bbbbccc', 'dde'])
+        row.remove_child(row._children[0])
+        screen.clear()
+        layout.render(screen, 0, 0, 0, 0, 2, 10)
+        self.assertScreenContent(screen, ['bbbbccc', 'dd  e'])
+
+    def test_windowed_widths(self):
+        layout = ColumnLayout()
+        layout.add_cell(Cell())
+        layout.add_cell(Cell())
+        for n in range(1000):
+            layout.add_child(Row([Text('x' * (1 + n // 100)), Text('y')]))
+        screen = MockScreen(2, 20)
+        layout.render(screen, 0, 0, 998, 0, 2, 20)
+        self.assertScreenContent(screen, ['xxxxxxxxxxy', 'xxxxxxxxxxy'])
+        layout.render(screen, 0, 0, 0, 0, 2, 20)
+        self.assertScreenContent(screen, ['xy', 'xy'])
+        layout.whole_table = True
+        layout.render(screen, 0, 0, 0, 0, 2, 20)
+        self.assertScreenContent(screen, ['x         y', 'x         y'])
+
+    def test_lazy_refit(self):
+        layout = ColumnLayout()
+        layout.add_cell(Cell())
+        layout.add_cell(Cell())
+        rows = [Row([Text('x' * (1 + n // 100)), Text('y')]) for n in range(1000)]
+        for row in rows:
+            layout.add_child(row)
+        screen = MockScreen(2, 20)
+        for page in (0, 500, 998, 0):
+            screen.clear()
+            layout.render(screen, 0, 0, page, 0, 2, 20)
+        self.assertScreenContent(screen, ['xy', 'xy'])
+        self.assertEqual(screen.invalidated, [])
+        fitted = [row for row in rows if row._cell_generation == layout._cell_generation]
+        self.assertEqual(fitted, rows[0:2])
+
+        layout.render(screen, 0, 0, 0, 0, 2, 20)
+        rows[1]._children[0].set_text('xxx')
+        layout.repaint()
+        self.assertScreenContent(screen, ['x  y', 'xxxy'])
+
 class RowLayoutTest(SoupUITestCase):
     def test_render(self):
         tulip = RowLayout()
@@ -178,3 +722,301 @@ class RowLayoutTest(SoupUITestCase):
             'bbbddd',
             '',
         ])
+
+class AnsiScreenTest(SoupUITestCase):
+    def test_render_single_write(self):
+        sink = BufferSink()
+        screen = AnsiScreen(2, 10, sink)
+        screen.theme.set_class('x', fg=Ansi256(ColorName.RED))
+        VContainer([Text('hello').add_class('x'), Text('world')]).render(screen, 0, 0, 0, 0, 2, 10)
+        screen.render()
+        self.assertEqual(sink.num_writes, 1)
+        out = sink.getvalue()
+        self.assertIn(b'\x1b[0;38;5;1mhello', out)
+        self.assertIn(b'world', out)
+
+    def test_render_only_changes(self):
+        sink = BufferSink()
+        screen = AnsiScreen(3, 20, sink)
+        clock = Text('12:00')
+        vcont = VContainer([Text('status'), clock, Text('footer')])
+        vcont.render(screen, 0, 0, 0, 0, 3, 20)
+        screen.render()
+
+        screen.clear()
+        vcont.render(screen, 0, 0, 0, 0, 3, 20)
+        screen.render()
+        self.assertEqual(sink.num_writes, 1)
+
+        del sink.buffer[:]
+        clock.set_text('12:01')
+        screen.clear()
+        vcont.render(screen, 0, 0, 0, 0, 3, 20)
+        screen.render()
+        self.assertEqual(sink.getvalue(), b'\x1b[2;5H\x1b[0m1\x1b[0m\x1b[?25l')
+
+class BatchTest(SoupUITestCase):
+    def test_put_runs_and_fill(self):
+        screen = AnsiScreen(3, 10, BufferSink())
+        screen.theme.set_class('x', fg=Ansi256(1))
+        x = screen.style_id(('x',))
+        screen.fill(0, 0, 3, 10, x)
+        screen.layer += 1
+        screen.put_runs([(0, 1, 'ab', 0), (2, 8, 'cdef', x)])
+        self.assertEqual(screen.grid.text(0, 0, 4), ' ab ')
+        self.assertEqual(list(screen.grid.styles[0:4]), [x, 0, 0, x])
+        self.assertEqual(screen.grid.text(2, 7, 10), ' cd')
+        self.assertRaises(RuntimeError, screen.put_runs, [(3, 0, 'a', 0)])
+
+    def test_clipped_fill(self):
+        screen = MockScreen(3, 6)
+        screen.put_runs([(y, 0, 'xxxxxx', 0) for y in range(3)])
+        screen.damage(1, 2, 1, 2)
+        screen.begin_repaint()
+        screen.fill(0, 0, 3, 6, 0)
+        screen.put_runs([(1, 0, 'abcdef', 0)])
+        screen.end_repaint()
+        self.assertScreenContent(screen, ['xxxxxx', 'xxcdxx', 'xxxxxx'])
+
+class CellGridTest(SoupUITestCase):
+    def test_layers(self):
+        grid = CellGrid(1, 10)
+        grid.put(0, 2, 'abcdef', 1, 5)
+        grid.put(0, 0, 'xyzw', 2, 3)
+        grid.put(0, 6, 'UV', 3, 5)
+        self.assertEqual(grid.text(0, 0, 10), 'xyabcdUV\0\0')
+        self.assertEqual(list(grid.styles), [2, 2, 1, 1, 1, 1, 3, 3, 0, 0])
+        grid.erase(0, 1, 1, 2)
+        self.assertEqual(grid.text(0, 0, 4), 'x\0\0b')
+
+    def test_snapshot(self):
+        screen = MockScreen(2, 10)
+        vcont = VContainer([Text('hello'), Text('world')])
+        vcont.render(screen, 0, 0, 0, 0, 2, 10)
+        before = screen.snapshot()
+        screen.clear()
+        vcont.render(screen, 0, 0, 0, 0, 2, 10)
+        self.assertEqual(screen.snapshot(), before)
+        vcont._children[1].set_text('there')
+        screen.clear()
+        vcont.render(screen, 0, 0, 0, 0, 2, 10)
+        self.assertNotEqual(screen.snapshot(), before)
+
+class KeypressTest(SoupUITestCase):
+    def test_dispatch(self):
+        leaf = Text('leaf')
+        root = leaf
+        for _ in range(2000):
+            root = VContainer([root])
+        calls = []
+        root.onkey('x', lambda w, key: calls.append('root') or True)
+        leaf.parent.onkey('x', lambda w, key: calls.append('parent'))
+        leaf.keypress('x')
+        self.assertEqual(calls, ['parent', 'root'])
+        self.assertFalse(leaf.try_keypress('y'))
+        self.assertRaises(UnhandledKeyError, leaf.keypress, 'y')
+        leaf.onkey('y', lambda w, key: calls.append('leaf') or True)
+        self.assertTrue(leaf.try_keypress('y'))
+        self.assertEqual(calls[-1], 'leaf')
+
+    def test_rebind(self):
+        leaf = Text('leaf')
+        VContainer([leaf]).onkey('x', lambda w, key: True)
+        self.assertTrue(leaf.try_keypress('x'))
+        other = VContainer()
+        other.onkey('z', lambda w, key: True)
+        self.assertFalse(leaf.try_keypress('z'))
+        leaf.parent.remove_child(leaf)
+        other.add_child(leaf)
+        self.assertTrue(leaf.try_keypress('z'))
+        self.assertFalse(leaf.try_keypress('x'))
+
+    def test_direct_changes(self):
+        leaf = Text('leaf')
+        root = VContainer([leaf])
+        self.assertFalse(leaf.try_keypress('x'))
+        root.key_handlers['x'] = (lambda w, key: True, None)
+        self.assertTrue(leaf.try_keypress('x'))
+        del root.key_handlers['x']
+        self.assertFalse(leaf.try_keypress('x'))
+        root.key_handlers = {'y': (lambda w, key: True, None)}
+        self.assertTrue(leaf.try_keypress('y'))
+        root.key_handlers.update(z=(lambda w, key: True, None))
+        self.assertTrue(leaf.try_keypress('z'))
+        root.unbind('y')
+        root.unbind('never bound')
+        self.assertFalse(leaf.try_keypress('y'))
+        self.assertIsNone(Text('fresh')._key_handlers)
+
+    def test_overrides(self):
+        calls = []
+        class Greedy(Text):
+            def handle_keypress(self, key):
+                calls.append(key)
+                return True
+        class Logging(VContainer):
+            def keypress(self, key):
+                calls.append('log ' + key)
+                super().keypress(key)
+        leaf = Greedy('leaf')
+        root = Logging([VContainer([leaf])])
+        root.onkey('x', lambda w, key: True)
+        self.assertTrue(leaf.try_keypress('y'))
+        self.assertEqual(calls, ['y'])
+        plain = Text('plain')
+        root.add_child(plain)
+        self.assertTrue(plain.try_keypress('x'))
+        self.assertRaises(UnhandledKeyError, plain.keypress, 'z')
+        self.assertEqual(calls, ['y', 'log x', 'log z'])
+
+    def test_cached_across_tree_changes(self):
+        leaf = Text('leaf')
+        root = VContainer([VContainer([leaf])])
+        root.onkey('x', lambda w, key: True)
+        table = leaf.key_table()
+        root.add_child(Text('other'))
+        VirtualContainer(lambda: 10, lambda k: Text(str(k))).child(3)
+        self.assertIs(leaf.key_table(), table)
+
+class KeyDecoderTest(SoupUITestCase):
+    def test_keys(self):
+        d = KeyDecoder()
+        keys = d.feed(b'ab\r\x01\x1b[A\x1bOP\x1b[1;5C\x1b[5~\x1b[Z\x1bx\xc3\xa9')
+        self.assertEqual(keys, ['a', 'b', 'enter', 'ctrl-a', 'up', 'f1', 'ctrl-right',
+            'pageup', 'shift-tab', 'alt-x', '\xe9'])
+        self.assertFalse(d.pending)
+
+    def test_incremental(self):
+        d = KeyDecoder()
+        self.assertEqual(d.feed(b'\x1b[1;'), [])
+        self.assertEqual(d.feed(b'2B\xc3'), ['shift-down'])
+        self.assertEqual(d.feed(b'\xa9\x1b'), ['\xe9'])
+        self.assertTrue(d.pending)
+        self.assertEqual(d.flush(), ['escape'])
+
+    def test_paste_and_mouse(self):
+        d = KeyDecoder()
+        self.assertEqual(d.feed(b'\x1b[200~hello\n'), [])
+        keys = d.feed(b'world\x1b[201~\x1b[<0;5;3M\x1b[<65;1;1M')
+        self.assertEqual(keys, ['paste', 'mouse-press', 'scroll-down'])
+        self.assertEqual(keys[0].text, 'hello\nworld')
+        self.assertEqual(keys[1].mouse, (0, 2, 4))
+
+    def test_collapse(self):
+        keys = KeyDecoder().feed(b'\x1b[6~' * 30 + b'jj')
+        keys = collapse(keys, {'pagedown'})
+        self.assertEqual(keys, ['pagedown', 'j', 'j'])
+        self.assertEqual(keys[0].repeat, 30)
+        pager = Pager([Text(str(n)) for n in range(100)])
+        pager.onkey('pagedown', lambda w, key: w.next_page(key.repeat) or True)
+        pager.render(MockScreen(3, 5), 0, 0, 0, 0, 3, 5)
+        pager.keypress(keys[0])
+        self.assertEqual(pager.vscroll, 90)
+
+class ApplicationTest(SoupUITestCase):
+    def test_coalesced_redraw(self):
+        text = Text('>')
+        text.focusable = True
+        root = VContainer([text, Text('status')])
+        text.focus()
+        text.onkey('q', lambda w, key: app.exit() or True)
+        text.onkey('up', lambda w, key: w.set_text('up') or True)
+        keys = []
+        for c in 'typed fast':
+            text.onkey(c, lambda w, key: keys.append(key) or w.set_text(w.text + key) or True)
+        screen = MockScreen(2, 20)
+        app = Application(root, screen, fps=1000)
+        r, w = os.pipe()
+        app.input_fd = r
+
+        async def main():
+            task = asyncio.ensure_future(app.run_async())
+            await asyncio.sleep(0.01)
+            self.assertEqual(app.num_frames, 1)
+            self.assertTrue(os.get_blocking(r))
+            os.write(w, b'typed fast')
+            await asyncio.sleep(0.01)
+            self.assertEqual(app.num_frames, 2)
+            self.assertScreenContent(screen, ['>typed fast', 'status'])
+            os.write(w, b'\x1b[Aq')
+            await task
+
+        try:
+            asyncio.run(main())
+        finally:
+            os.close(r)
+            os.close(w)
+        self.assertEqual(''.join(keys), 'typed fast')
+        self.assertEqual(text.text, 'up')
+
+    def test_leaf_keypress_override(self):
+        calls = []
+        class Prompt(Text):
+            def keypress(self, key):
+                calls.append(key)
+        prompt = Prompt('>')
+        prompt.focusable = True
+        root = VContainer([prompt])
+        prompt.focus()
+        app = Application(root, MockScreen(1, 10))
+        app.on_unhandled_key = lambda key: calls.append('unhandled ' + key)
+        app.keypress('a')
+        self.assertEqual(calls, ['a'])
+        app._dispatch([Key('c')])
+        self.assertEqual(calls, ['a', 'c'])
+
+    def test_sink_waits(self):
+        r, w = os.pipe()
+        os.set_blocking(w, False)
+        data = bytes(range(256)) * 4096
+        received = bytearray()
+        def drain():
+            while len(received) < len(data):
+                received.extend(os.read(r, 65536))
+        reader = threading.Thread(target=drain)
+        reader.start()
+        try:
+            FdSink(w).write(data)
+            reader.join()
+        finally:
+            os.close(r)
+            os.close(w)
+        self.assertEqual(received, data)
+
+class ThemeTest(SoupUITestCase):
+    def test_style_cache(self):
+        theme = Theme()
+        a, b = Ansi256(1), Ansi256(2)
+        theme.set_class('a', fg=a)
+        theme.set_class('b', fg=b, fmt=AnsiFormat.BOLD)
+        style = theme.get_style(['a', 'b'])
+        self.assertEqual(style, (b, None, AnsiFormat.BOLD))
+        self.assertEqual(theme._sgr[theme.style_id(['a', 'b'])], b'\x1b[0;38;5;2;1m')
+        self.assertIs(theme.get_style(('a', 'b')), style)
+        c = TrueColor(1, 2, 3)
+        theme.set_class('b', bg=c)
+        self.assertEqual(theme.get_style(['a', 'b']), (a, c, None))
+        self.assertEqual(theme._sgr[theme.style_id(['a', 'b'])], b'\x1b[0;38;5;1;48;2;1;2;3m')
+        self.assertEqual(theme.get_style(['c']), (None, None, None))
+        self.assertEqual(theme.style_id(['c']), 0)
+
+    def test_static_helpers(self):
+        r, w = os.pipe()
+        saved = os.dup(1)
+        try:
+            os.dup2(w, 1)
+            AnsiScreen.write_cmd('[0m')
+            Ansi256(3).setfg()
+            TrueColor(1, 2, 3).setbg()
+        finally:
+            os.dup2(saved, 1)
+            os.close(saved)
+            os.close(w)
+        with os.fdopen(r, 'rb') as f:
+            self.assertEqual(f.read(), b'\x1b[0m\x1b[38;5;3m\x1b[48;2;1;2;3m')
+        sink = BufferSink()
+        screen = AnsiScreen(1, 5, sink)
+        Ansi256(3).setfg(screen)
+        screen.write_cmd('[0m')
+        screen.flush()
+        self.assertEqual(sink.getvalue(), b'\x1b[38;5;3m\x1b[0m')
@@ -6,7 +6,13 @@ def print_indented(string, indent):
 from tulip.keypress import KeypressMixin, UnhandledKeyError
 from tulip.widget import Widget, Air, Empty, focusable_p
 from tulip.container import Container, HContainer, VContainer
+from tulip.output import FdSink, SocketSink, BufferSink, NullSink
 from tulip.screen import MockScreen, AnsiScreen
 from tulip.layout import Cell, CellGroup, Row, ColumnLayout, Column, RowLayout, HAlign, VAlign
-from tulip.pager import Pager
+from tulip.pager import Pager, StreamPager
+from tulip.virtual import VirtualContainer
+from tulip.fileview import FileView
 from tulip.text import Text, Paragraph
+from tulip.profiler import Profiler
+from tulip.input import Key, KeyDecoder
+from tulip.app import Application
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import signal
+import termios
+import tty
+from tulip.input import KeyDecoder, collapse
+from tulip.keypress import UnhandledKeyError
+from tulip.output import FdSink
+from tulip.screen import AnsiScreen
+
+class Application:
+    """Runs a widget tree on a terminal with asyncio.
+
+    Input is read when it's available, decoded by a KeyDecoder and dispatched
+    to the focused widget as keypresses. Runs of the keys named in
+    collapse_keys are passed as one Key with repeat set, for handlers which
+    can take a number of presses at once. Whatever damages the screen in
+    the meantime (keypresses, tasks updating widgets) is repainted in a
+    single frame, and frames are never drawn more often than fps times a
+    second.
+
+    Widgets may only be changed from the event loop's thread; other threads
+    should go through call_from_thread().
+    """
+
+    READ_SIZE = 65536
+    ESCAPE_TIMEOUT = 0.05 # seconds to wait for the rest of an escape sequence
+
+    def __init__(self, root, screen = None, fps = 30, input_fd = 0, output_fd = 1, mouse = False):
+        self.root = root
+        self.fps = fps
+        self.input_fd = input_fd
+        self.output_fd = output_fd
+        self.screen = screen
+        self.mouse = mouse
+        self.decoder = KeyDecoder()
+        self.collapse_keys = set()
+        self.num_frames = 0
+        self._loop = None
+        self._done = None
+        self._redraw_handle = None
+        self._last_frame = None
+        self._rendering = False
+        self._full_redraw = True
+        self._term_attrs = None
+        self._escape_handle = None
+
+    def _make_screen(self):
+        cols, rows = os.get_terminal_size(self.output_fd)
+        screen = AnsiScreen(rows, cols, FdSink(self.output_fd))
+        if self.screen:
+            screen.theme = self.screen.theme
+        return screen
+
+    def _attach(self, screen):
+        self.screen = screen
+        screen.on_change = self.schedule_redraw
+        self._full_redraw = True
+        self.schedule_redraw()
+
+    def schedule_redraw(self):
+        """Makes sure a frame is drawn soon; calling this repeatedly only draws one.
+        """
+
+        if self._redraw_handle or self._rendering or not self._loop:
+            return
+        delay = 0.0
+        if self._last_frame is not None:
+            delay = max(0.0, self._last_frame + 1 / self.fps - self._loop.time())
+        self._redraw_handle = self._loop.call_later(delay, self._redraw)
+
+    def invalidate(self):
+        """Redraws everything in the next frame.
+        """
+
+        self._full_redraw = True
+        self.schedule_redraw()
+
+    def _redraw(self):
+        self._redraw_handle = None
+        self._last_frame = self._loop.time()
+        screen = self.screen
+        self._rendering = True
+        try:
+            if self._full_redraw or not self.root.render_args:
+                self._full_redraw = False
+                screen.clear()
+                self.root.render(screen, 0, 0, 0, 0, screen.nrows, screen.ncols)
+            else:
+                self.root.repaint()
+            screen.render()
+        finally:
+            self._rendering = False
+        self.num_frames += 1
+
+    def _on_input(self):
+        # the fd is readable, so a single read doesn't block; the fd itself is
+        # left blocking, as a terminal's stdin and stdout usually share the flag
+        data = os.read(self.input_fd, self.READ_SIZE)
+        if not data:
+            self.exit()
+        if self._escape_handle:
+            self._escape_handle.cancel()
+            self._escape_handle = None
+        self._dispatch(self.decoder.feed(data))
+        if self.decoder.pending:
+            self._escape_handle = self._loop.call_later(self.ESCAPE_TIMEOUT, self._flush_input)
+
+    def _flush_input(self):
+        self._escape_handle = None
+        self._dispatch(self.decoder.flush())
+
+    def _dispatch(self, keys):
+        for key in collapse(keys, self.collapse_keys):
+            self.keypress(key)
+
+    def keypress(self, key):
+        try:
+            self.root.focused_leaf().keypress(key)
+        except UnhandledKeyError:
+            self.on_unhandled_key(key)
+
+    def on_unhandled_key(self, key):
+        pass
+
+    def _on_resize(self):
+        self.screen.on_change = None
+        self._attach(self._make_screen())
+
+    def call_from_thread(self, f, *args):
+        """Calls f(*args) in the event loop, for use from other threads.
+        """
+
+        self._loop.call_soon_threadsafe(f, *args)
+
+    def exit(self):
+        if self._done and not self._done.done():
+            self._done.set_result(None)
+
+    def _setup_terminal(self):
+        if os.isatty(self.input_fd):
+            self._term_attrs = termios.tcgetattr(self.input_fd)
+            tty.setcbreak(self.input_fd)
+        self._loop.add_reader(self.input_fd, self._on_input)
+        if isinstance(self.screen, AnsiScreen):
+            self.screen.write_cmd('[?1049h')
+            self.screen.write_cmd('[?2004h') # bracketed paste
+            if self.mouse:
+                self.screen.write_cmd('[?1002h')
+                self.screen.write_cmd('[?1006h') # SGR reports
+            try:
+                self._loop.add_signal_handler(signal.SIGWINCH, self._on_resize)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    def _restore_terminal(self):
+        self._loop.remove_reader(self.input_fd)
+        if isinstance(self.screen, AnsiScreen):
+            self._loop.remove_signal_handler(signal.SIGWINCH)
+            if self.mouse:
+                self.screen.write_cmd('[?1006l')
+                self.screen.write_cmd('[?1002l')
+            self.screen.write_cmd('[?2004l')
+            self.screen.write_cmd('[0m')
+            self.screen.write_cmd('[?25h')
+            self.screen.write_cmd('[?1049l')
+            self.screen.flush()
+        if self._term_attrs:
+            termios.tcsetattr(self.input_fd, termios.TCSADRAIN, self._term_attrs)
+            self._term_attrs = None
+
+    async def run_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._done = self._loop.create_future()
+        self._attach(self.screen or self._make_screen())
+        self._setup_terminal()
+        try:
+            await self._done
+        finally:
+            for handle in (self._redraw_handle, self._escape_handle):
+                if handle:
+                    handle.cancel()
+            self._redraw_handle = self._escape_handle = None
+            self._restore_terminal()
+            self._loop = None
+
+    def run(self):
+        asyncio.run(self.run_async())
@@ -1,8 +1,19 @@
 import tulip
+from tulip.index import SizeIndex, MaxIndex
+
+# shared by all containers without invalidated children
+_NO_STALE = frozenset()
 
 class Container(tulip.Widget):
+    __slots__ = ('_index', '_index_b', '_max_index', '_stale')
+
     def __init__(self, children = []):
         super().__init__()
+        self._children = []
+        self._index = None
+        self._index_b = None
+        self._max_index = None
+        self._stale = _NO_STALE # positions of invalidated children
         for child in children:
             self.add_child(child)
 
@@ -11,18 +22,113 @@ class Container(tulip.Widget):
         return self._children
 
     def add_child(self, child):
+        child._position = len(self._children)
         self._children.append(child)
         child.parent = self
+        child._reparented()
+        if self._focus_index is not None:
+            self._focus_index.append(child._focusable_count)
+        self._add_focusable(child._focusable_count)
+        self.invalidate()
+
+    def insert_child(self, k, child):
+        """Inserts child before the k-th child.
+        """
+
+        self._children.insert(k, child)
+        child.parent = self
+        child._reparented()
+        self._renumber(k)
+        self._index = None
+        self._focus_index = None
+        self._add_focusable(child._focusable_count)
         self.invalidate()
 
+    def remove_child(self, child):
+        k = self.child_index(child)
+        del self._children[k]
+        self._orphan((child,))
+        self._renumber(k)
+        self._index = None
+        self._focus_index = None
+        self._add_focusable(-child._focusable_count)
+        self.invalidate()
+
+    def _truncate_children(self, stop):
+        """Removes children from the stop-th one on.
+        """
+
+        removed = self._children[stop:]
+        del self._children[stop:]
+        self._orphan(removed)
+        self._focus_index = None
+        self._add_focusable(-sum(child._focusable_count for child in removed))
+        self.reindex()
+
+    def _renumber(self, start):
+        children = self._children
+        for k in range(start, len(children)):
+            children[k]._position = k
+
+    def _orphan(self, children):
+        for child in children:
+            child.parent = None
+            child._position = None
+            child._reparented()
+            if self._focused_child is child:
+                self._focused_child = None
+
     def clear_children(self):
+        self._orphan(self._children)
         self._children.clear()
+        self._focused_child = None
+        self._index = None
+        self._focus_index = None
+        self._add_focusable(-(self._focusable_count - self._focusable))
         self.invalidate()
 
-    def invalidate(self):
-        super().invalidate()
-        if self.parent:
-            self.parent.invalidate()
+    def child_invalidated(self, child):
+        if self._index is not None:
+            if self._stale is _NO_STALE:
+                self._stale = set()
+            self._stale.add(child._position)
+        super().child_invalidated(child)
+
+    def reindex(self):
+        """Forgets sizes of the rendered widgets, for when they changed behind our back.
+        """
+
+        self._index = None
+        self.invalidate()
+
+    def _size_index(self, b):
+        """Returns prefix sums of sizes (in direction b) of the rendered widgets.
+
+        The index is built lazily, along with maxima of sizes in the other
+        direction. Widgets added since the last call are appended to it and
+        invalidated ones are updated, so only other changes of the children
+        force a rebuild.
+        """
+
+        widgets = self.rendered_widgets
+        if self._index is None or self._index_b != b:
+            self._index = SizeIndex()
+            self._max_index = MaxIndex()
+            self._index_b = b
+            self._stale = _NO_STALE
+        a = 1 - b
+        if self._stale:
+            stale, self._stale = self._stale, _NO_STALE
+            for k in stale:
+                if k < len(self._index):
+                    size = widgets[k].size
+                    self._index.update(k, size[b])
+                    self._max_index.update(k, size[a])
+        for k in range(len(self._index), len(widgets)):
+            size = widgets[k].size
+            self._index.append(size[b])
+            self._max_index.append(size[a])
+        return self._index
 
     def _render_generic(self, screen, y, x, i, j, rows, cols, a, b):
         """Renders widgets either horizontally or vertically (depending on a and b).
@@ -31,21 +137,18 @@ class Container(tulip.Widget):
         yx = [y, x]
         ij = [i, j]
         rows_cols = [rows, cols]
-        self.visible_start = 0
 
+        old_start, old_stop = self.visible_start, self.visible_stop
         # skip widgets which are out of the visible area
-        for widget in self.rendered_widgets:
-            if widget.size[b] > ij[b]:
-                break
-            self.visible_start += 1
-            ij[b] -= widget.size[b]
-            assert ij[b] >= 0
+        self.visible_start, ij[b] = self._size_index(b).find(ij[b])
 
         screen.layer += 1
         # render widgets which fall into the visible area, calculate total size
         total_size = [0, 0]
         self.visible_stop = self.visible_start
-        for widget in self.rendered_widgets[self.visible_start:]:
+        widgets = self.rendered_widgets
+        for k in range(self.visible_start, len(widgets)):
+            widget = widgets[k]
             rsize = widget.render(screen, *yx, *ij, *rows_cols)
             self.visible_stop += 1
             yx[b] += rsize[b]
@@ -56,36 +159,45 @@ class Container(tulip.Widget):
             if rows_cols[b] <= 0:
                 break
         screen.layer -= 1
+        # widgets which were rendered and now aren't are no longer on the screen
+        for k in range(old_start, old_stop):
+            if not self.visible_start <= k < self.visible_stop:
+                widget = self._rendered_widget(k)
+                if widget is not None:
+                    widget.render_args = None
 
         screen.draw_rectangle(y, x, total_size[0], total_size[1], self.resulting_classes)
         return tuple(total_size)
 
+    def _rendered_widget(self, k):
+        widgets = self.rendered_widgets
+        return widgets[k] if k < len(widgets) else None
+
     def _measure_generic(self, a, b):
         """Returns size when rendered horizontally or vertically (depending on a and b).
         """
 
         total_size = [0, 0]
-        for widget in self.rendered_widgets:
-            size = widget.size
-            total_size[a] = max(total_size[a], size[a])
-            total_size[b] += size[b]
+        total_size[b] = self._size_index(b).total
+        total_size[a] = self._max_index.max
         return tuple(total_size)
 
     def _child_offset_generic(self, w, b):
         o = [0, 0]
-        for c in self._children:
-            if c == w:
-                break
-            o[b] += c.size[b]
+        o[b] = self._size_index(b).prefix(self.child_index(w))
         return tuple(o)
 
     def child_index(self, w):
-        return self._children.index(w)
+        if w.parent is not self:
+            raise ValueError('{} is not a child of {}'.format(w, self))
+        return w._position
 
 class HContainer(Container):
     """Renders widgets horizontally from left to right.
     """
 
+    __slots__ = ()
+
     def _render(self, screen, y, x, i, j, rows, cols):
         return super()._render_generic(screen, y, x, i, j, rows, cols, 0, 1)
 
@@ -98,6 +210,8 @@ class HContainer(Container):
 class VContainer(Container):
     """Renders widgets vertically from top to bottom.
     """
+
+    __slots__ = ()
     
     def _render(self, screen, y, x, i, j, rows, cols):
         return super()._render_generic(screen, y, x, i, j, rows, cols, 1, 0)
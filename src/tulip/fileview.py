@@ -0,0 +1,144 @@
+import asyncio
+import mmap
+import os
+from array import array
+from itertools import accumulate, islice
+import tulip
+from tulip.width import clip, text_width
+
+class FileView(tulip.Widget):
+    """Shows a file of any size, one line per row.
+
+    The file is memory-mapped and only the lines which are rendered are
+    decoded. Starts of lines are indexed in an array('Q'), chunk by chunk:
+    call index_step() until it returns False, or run the index() coroutine
+    in the background; the widget grows as lines are indexed. Any line can
+    then be found in O(1).
+
+    The width is the length in bytes of the longest line indexed, or that of
+    the widest line rendered if that's more (e.g. because of tabs).
+
+    Changes of the file are only noticed by refresh(). Call it before
+    rendering a file which may have shrunk: reading a mapping past the end
+    of its file crashes.
+    """
+
+    CHUNK_SIZE = 1 << 22
+
+    def __init__(self, path, encoding = 'utf-8'):
+        super().__init__()
+        self.path = path
+        self.encoding = encoding
+        # offsets[k] is where the k-th line starts, offsets[-1] where the last one indexed ends
+        self.offsets = array('Q', [0])
+        self._file = open(path, 'rb')
+        self._map = None
+        self._file_size = 0
+        self._indexed = 0
+        self._unterminated = False # the last line has no newline
+        self._cols = 0
+        self._max_bytes = 0
+        self.refresh()
+
+    def refresh(self):
+        """Maps the file again if it grew, so that index_step() picks up the
+        new lines. If it shrank (e.g. was truncated by log rotation), the
+        index is started over.
+        """
+
+        size = os.fstat(self._file.fileno()).st_size
+        if size == self._file_size:
+            return
+        if self._map:
+            self._map.close()
+            self._map = None
+        if size < self._file_size:
+            self.offsets = array('Q', [0])
+            self._indexed = 0
+            self._unterminated = False
+            self._cols = 0
+            self._max_bytes = 0
+            self.invalidate()
+        self._file_size = size
+        if size == 0:
+            return
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._unterminated:
+            # the last line may go on
+            self.offsets.pop()
+            self._indexed = self.offsets[-1]
+            self._unterminated = False
+
+    def close(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    @property
+    def num_lines(self):
+        return len(self.offsets) - 1
+
+    @property
+    def indexed(self):
+        return self._indexed >= self._file_size
+
+    def index_step(self, max_bytes = None):
+        """Indexes lines in up to max_bytes more of the file. Returns whether there's more to do.
+        """
+
+        if self.indexed:
+            return False
+        start = self._indexed
+        stop = min(start + (max_bytes or self.CHUNK_SIZE), self._file_size)
+        if self._map.find(b'\n', start, stop) < 0 and stop < self._file_size:
+            # a very long line, take all of it
+            nl = self._map.find(b'\n', stop)
+            stop = nl + 1 if nl >= 0 else self._file_size
+        chunk = self._map[start:stop]
+        last = chunk.rfind(b'\n')
+        if last >= 0:
+            pieces = chunk[:last].split(b'\n')
+            self._max_bytes = max(self._max_bytes, len(max(pieces, key=len).rstrip(b'\r')))
+            ends = accumulate(map((1).__add__, map(len, pieces)), initial=start)
+            self.offsets.extend(islice(ends, 1, None))
+            self._indexed = start + last + 1
+        if stop == self._file_size:
+            if self._indexed < stop:
+                self.offsets.append(stop)
+                self._max_bytes = max(self._max_bytes, stop - self._indexed)
+                self._unterminated = True
+            self._indexed = stop
+        self.invalidate()
+        return not self.indexed
+
+    async def index(self, max_bytes = None):
+        """Indexes the whole file, yielding to the event loop after each chunk.
+        """
+
+        while self.index_step(max_bytes):
+            await asyncio.sleep(0)
+
+    def line(self, k):
+        """Returns the k-th line, decoded and without the line break.
+        """
+
+        start, end = self.offsets[k], self.offsets[k + 1]
+        data = self._map[start:end].rstrip(b'\r\n')
+        return data.decode(self.encoding, errors='replace').expandtabs()
+
+    def _measure(self):
+        return (self.num_lines, max(self._cols, self._max_bytes))
+
+    def _render(self, screen, y, x, i, j, rows, cols):
+        nrows = max(0, min(rows, self.num_lines - i))
+        style = screen.style_id(self.resulting_classes)
+        runs = []
+        for k in range(0, nrows):
+            line = self.line(i + k)
+            self._cols = max(self._cols, text_width(line))
+            text = clip(line, j, cols)
+            if text:
+                runs.append((y + k, x, text, style))
+        screen.put_runs(runs)
+        return (nrows, max((text_width(run[2]) for run in runs), default=0))
@@ -0,0 +1,243 @@
+import sys
+from array import array
+from functools import lru_cache
+from tulip.width import char_width, clusters
+
+_UTF32 = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+assert array('I').itemsize == 4
+
+# _WRITABLE[layer] maps the layers of cells to 1 where a put to layer may overwrite them
+_WRITABLE = [bytes([1]) * (layer + 1) + bytes(255 - layer) for layer in range(0, 256)]
+
+# Values of cells above the range of codepoints: the right halves of wide
+# characters, and clusters of several codepoints (see cells)
+WIDE_TAIL = 0x110000
+_CLUSTER_BASE = 0x110001
+_clusters = []
+_cluster_ids = {}
+
+_SPACE = ord(' ')
+
+def codepoints(text):
+    a = array('I')
+    a.frombytes(text.encode(_UTF32))
+    return a
+
+def _cluster_code(cluster):
+    if len(cluster) == 1:
+        return ord(cluster)
+    code = _cluster_ids.get(cluster)
+    if code is None:
+        code = _cluster_ids[cluster] = _CLUSTER_BASE + len(_clusters)
+        _clusters.append(cluster)
+    return code
+
+def _cell_text(code):
+    if code < WIDE_TAIL:
+        return chr(code)
+    return '' if code == WIDE_TAIL else _clusters[code - _CLUSTER_BASE]
+
+@lru_cache(maxsize=4096)
+def _wide_cells(text):
+    a = array('I')
+    for cluster, w in clusters(text):
+        if w:
+            a.append(_cluster_code(cluster))
+            if w == 2:
+                a.append(WIDE_TAIL)
+    return a
+
+def cells(text):
+    """Returns the values of the cells text takes, one per column. Wide
+    characters take a cell and a WIDE_TAIL one. The result is shared, don't
+    modify it.
+    """
+
+    if text.isascii():
+        return codepoints(text)
+    return _wide_cells(text)
+
+@lru_cache(maxsize=1024)
+def _run(value, n):
+    # n cells of the same value (a codepoint or style id), shared
+    return array('I', [value]) * n
+
+@lru_cache(maxsize=1024)
+def _layer_run(layer, n):
+    return bytes((layer,)) * n
+
+class CellGrid:
+    """The cells of a screen in flat arrays: codepoints, style ids and layers.
+
+    A put overwrites cells whose layer is lower than or equal to its own,
+    so the result doesn't depend on the order of puts to different layers
+    and no sorting is needed to compose a frame. Parts of a put occluded by
+    higher layers are skipped at put time.
+    Cells nothing was put to hold the blank codepoint.
+    """
+
+    def __init__(self, nrows, ncols, blank = 0):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.blank = blank
+        self._empty_chars = array('I', [blank]) * (nrows * ncols)
+        self._empty_styles = array('I', [0]) * (nrows * ncols)
+        self._empty_layers = bytes(nrows * ncols)
+        self.chars = array('I', self._empty_chars)
+        self.styles = array('I', self._empty_styles)
+        self.layers = bytearray(self._empty_layers)
+
+    def __eq__(self, other):
+        return self.chars == other.chars and self.styles == other.styles
+
+    def clear(self):
+        self.chars[:] = self._empty_chars
+        self.styles[:] = self._empty_styles
+        self.layers[:] = self._empty_layers
+
+    def copy(self):
+        grid = CellGrid(self.nrows, self.ncols, self.blank)
+        grid.assign(self)
+        return grid
+
+    def assign(self, other):
+        self.chars[:] = other.chars
+        self.styles[:] = other.styles
+        self.layers[:] = other.layers
+
+    def put(self, y, x, text, style, layer):
+        self.put_cells(y, x, cells(text), style, layer)
+
+    def put_cells(self, y, x, codes, style, layer):
+        """Puts the cell values returned by cells(). Halves of wide characters
+        cut off at either end, and those left behind in the grid by overwriting
+        the other half, are replaced by spaces.
+        """
+
+        n = min(len(codes), self.ncols - x)
+        if n <= 0:
+            return
+        if codes[0] == WIDE_TAIL or (n < len(codes) and codes[n] == WIDE_TAIL):
+            cut = array('I', codes[0:n])
+            if cut[0] == WIDE_TAIL:
+                cut[0] = _SPACE
+            if n < len(codes) and codes[n] == WIDE_TAIL:
+                cut[n - 1] = _SPACE
+            codes = cut
+        elif n < len(codes):
+            codes = codes[0:n]
+        o = y * self.ncols + x
+        styles = _run(style, n)
+        if self.chars[o] == WIDE_TAIL or (x + n < self.ncols and self.chars[o + n] == WIDE_TAIL):
+            self._write_cells(o, x, codes, styles, min(layer, 255))
+        else:
+            self._write(o, codes, styles, min(layer, 255))
+
+    def _is_wide(self, k):
+        code = self.chars[k]
+        return code != WIDE_TAIL and char_width(_cell_text(code)[0]) == 2
+
+    def _write_cells(self, o, x, chars, styles, layer):
+        # a _write next to or over half of a wide character, keeps every
+        # WIDE_TAIL right after the cell of a wide character
+        end = o + len(chars)
+        left = x > 0 and self.chars[o] == WIDE_TAIL
+        right = x + len(chars) < self.ncols and self.chars[end] == WIDE_TAIL
+        self._write(o, chars, styles, layer)
+        if left and self.chars[o] != WIDE_TAIL:
+            self.chars[o - 1] = _SPACE
+        if right and not self._is_wide(end - 1):
+            self.chars[end] = _SPACE
+
+    def fill(self, y0, x, rows, cols, char, style, layer):
+        """Fills a rectangle with char, row by row as slice assignments.
+        A rectangle as wide as the grid is one slice, and needs no repairs
+        of wide characters at its edges.
+        """
+
+        x0 = max(x, 0)
+        x1 = min(x + cols, self.ncols)
+        y1 = min(y0 + rows, self.nrows)
+        y0 = max(y0, 0)
+        if x0 >= x1 or y0 >= y1:
+            return
+        layer = min(layer, 255)
+        if x1 - x0 == self.ncols:
+            self._fill(y0 * self.ncols, (y1 - y0) * self.ncols, char, style, layer)
+            return
+        n = x1 - x0
+        chars = _run(char, n)
+        styles = _run(style, n)
+        for y in range(y0, y1):
+            o = y * self.ncols + x0
+            if self.chars[o] == WIDE_TAIL or (x1 < self.ncols and self.chars[o + n] == WIDE_TAIL):
+                self._write_cells(o, x0, chars, styles, layer)
+            else:
+                self._fill(o, n, char, style, layer)
+
+    def _fill(self, o, n, char, style, layer):
+        # _write of n cells of the same char and style, which is never WIDE_TAIL
+        mask = self.layers[o:o + n].translate(_WRITABLE[layer])
+        k = mask.find(1)
+        while k >= 0:
+            end = mask.find(0, k)
+            if end < 0:
+                end = n
+            self.chars[o + k:o + end] = _run(char, end - k)
+            self.styles[o + k:o + end] = _run(style, end - k)
+            self.layers[o + k:o + end] = _layer_run(layer, end - k)
+            k = mask.find(1, end)
+
+    def _write(self, o, chars, styles, layer):
+        n = len(chars)
+        # the runs of cells which aren't above layer are overwritten
+        mask = self.layers[o:o + n].translate(_WRITABLE[layer])
+        if 0 not in mask:
+            self.chars[o:o + n] = chars
+            self.styles[o:o + n] = styles
+            self.layers[o:o + n] = _layer_run(layer, n)
+            return
+        k = mask.find(1)
+        while k >= 0:
+            end = mask.find(0, k)
+            if end < 0:
+                end = n
+            self.chars[o + k:o + end] = chars[k:end]
+            self.styles[o + k:o + end] = styles[k:end]
+            self.layers[o + k:o + end] = _layer_run(layer, end - k)
+            # halves of wide characters whose other half is occluded
+            if chars[k] == WIDE_TAIL:
+                self.chars[o + k] = _SPACE
+            if end < n and chars[end] == WIDE_TAIL:
+                self.chars[o + end - 1] = _SPACE
+            k = mask.find(1, end)
+
+    def erase(self, y0, x, rows, cols):
+        x0 = max(x, 0)
+        x1 = min(x + cols, self.ncols)
+        if x0 >= x1:
+            return
+        for y in range(max(y0, 0), min(y0 + rows, self.nrows)):
+            o = y * self.ncols
+            if x0 > 0 and self.chars[o + x0] == WIDE_TAIL:
+                self.chars[o + x0 - 1] = _SPACE
+            if x1 < self.ncols and self.chars[o + x1] == WIDE_TAIL:
+                self.chars[o + x1] = _SPACE
+            self.chars[o + x0:o + x1] = self._empty_chars[0:x1 - x0]
+            self.styles[o + x0:o + x1] = self._empty_styles[0:x1 - x0]
+            self.layers[o + x0:o + x1] = self._empty_layers[0:x1 - x0]
+
+    def text(self, y, x0, x1):
+        o = y * self.ncols
+        chars = self.chars[o + x0:o + x1]
+        try:
+            return chars.tobytes().decode(_UTF32)
+        except UnicodeDecodeError:
+            # WIDE_TAIL or clusters, which aren't codepoints
+            return ''.join(map(_cell_text, chars))
+
+    def row_equal(self, other, y):
+        o = y * self.ncols
+        p = o + self.ncols
+        return self.chars[o:p] == other.chars[o:p] and self.styles[o:p] == other.styles[o:p]
@@ -0,0 +1,169 @@
+class SizeIndex:
+    """Prefix sums over a sequence of sizes (a Fenwick tree).
+
+    Appending a size, changing one and computing a prefix sum are all
+    O(log n), so is finding which item covers a given offset.
+    """
+
+    def __init__(self, sizes = ()):
+        self._sizes = []
+        self._tree = [0]
+        for size in sizes:
+            self.append(size)
+
+    @classmethod
+    def zeros(cls, n):
+        """Returns an index of n sizes of 0, in O(n) without appending them.
+        """
+
+        index = cls()
+        index._sizes = [0] * n
+        index._tree = [0] * (n + 1)
+        return index
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __getitem__(self, k):
+        return self._sizes[k]
+
+    def append(self, size):
+        n = len(self._tree)
+        low = n - (n & -n)
+        k = n - 1
+        total = size
+        while k > low:
+            total += self._tree[k]
+            k -= k & -k
+        self._sizes.append(size)
+        self._tree.append(total)
+
+    def update(self, k, size):
+        delta = size - self._sizes[k]
+        if not delta:
+            return
+        self._sizes[k] = size
+        k += 1
+        while k < len(self._tree):
+            self._tree[k] += delta
+            k += k & -k
+
+    def prefix(self, k):
+        """Returns the sum of the first k sizes.
+        """
+
+        total = 0
+        while k > 0:
+            total += self._tree[k]
+            k -= k & -k
+        return total
+
+    @property
+    def total(self):
+        return self.prefix(len(self._sizes))
+
+    def find(self, offset):
+        """Returns (k, r) where k is the number of leading items which end
+        at or before offset, and r is what's left of offset after them.
+        """
+
+        k = 0
+        step = 1 << (len(self._sizes).bit_length())
+        while step:
+            if k + step < len(self._tree) and self._tree[k + step] <= offset:
+                k += step
+                offset -= self._tree[k]
+            step >>= 1
+        return (k, offset)
+
+class MaxIndex:
+    """Maxima of ranges of a sequence of sizes (a segment tree).
+
+    Appending a size, changing one and finding the maximum of a range are
+    all O(log n). Sizes are non-negative, the maximum of nothing is 0.
+    """
+
+    def __init__(self, sizes = ()):
+        self._n = 0
+        self._cap = 1
+        self._tree = [0, 0]
+        for size in sizes:
+            self.append(size)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, k):
+        return self._tree[self._cap + k]
+
+    def append(self, size):
+        if self._n == self._cap:
+            leaves = self._tree[self._cap:]
+            self._cap *= 2
+            self._tree = [0] * self._cap + leaves + [0] * (self._cap - len(leaves))
+            for k in range(self._cap - 1, 0, -1):
+                self._tree[k] = max(self._tree[2 * k], self._tree[2 * k + 1])
+        self._n += 1
+        self.update(self._n - 1, size)
+
+    def update(self, k, size):
+        tree = self._tree
+        k += self._cap
+        tree[k] = size
+        k //= 2
+        while k:
+            m = max(tree[2 * k], tree[2 * k + 1])
+            if tree[k] == m:
+                break
+            tree[k] = m
+            k //= 2
+
+    def query(self, lo, hi):
+        """Returns the maximum of sizes lo (inclusive) to hi (exclusive).
+        """
+
+        tree = self._tree
+        m = 0
+        lo += self._cap
+        hi += self._cap
+        while lo < hi:
+            if lo & 1:
+                m = max(m, tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                m = max(m, tree[hi])
+            lo //= 2
+            hi //= 2
+        return m
+
+    @property
+    def max(self):
+        return self._tree[1]
+
+class UniformIndex:
+    """The SizeIndex interface for n items of the same size, in O(1) space.
+    """
+
+    def __init__(self, n, size = 1):
+        self.n = n
+        self.size = size
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, k):
+        return self.size
+
+    def prefix(self, k):
+        return min(k, self.n) * self.size
+
+    @property
+    def total(self):
+        return self.n * self.size
+
+    def find(self, offset):
+        if offset < 0:
+            return (0, offset)
+        k = min(offset // self.size, self.n) if self.size else self.n
+        return (k, offset - k * self.size)
@@ -0,0 +1,203 @@
+import codecs
+
+class Key(str):
+    """A key event: the name of the key, as passed to KeypressMixin.keypress.
+
+    Names are characters ('a', 'A', ' ') or names of special keys ('enter',
+    'up', 'f5', 'paste', 'mouse-press', ...) prefixed with modifiers in the
+    order 'ctrl-alt-shift-'. repeat says how many times the key was pressed
+    in a row (see collapse), text is the pasted text of 'paste' events and
+    mouse is (button, y, x) of mouse events.
+    """
+
+    def __new__(cls, name, repeat = 1, text = None, mouse = None):
+        key = super().__new__(cls, name)
+        key.repeat = repeat
+        key.text = text
+        key.mouse = mouse
+        return key
+
+    def __repr__(self):
+        return 'Key({}, repeat={})'.format(str.__repr__(self), self.repeat)
+
+_CONTROL = {
+    '\r': 'enter',
+    '\n': 'enter',
+    '\t': 'tab',
+    '\x7f': 'backspace',
+    '\x08': 'backspace',
+    '\x00': 'ctrl-space',
+}
+for _c in range(1, 27):
+    _CONTROL.setdefault(chr(_c), 'ctrl-' + chr(ord('a') + _c - 1))
+
+# final bytes of CSI and SS3 sequences
+_FINAL = {
+    'A': 'up', 'B': 'down', 'C': 'right', 'D': 'left', 'E': 'begin',
+    'H': 'home', 'F': 'end', 'P': 'f1', 'Q': 'f2', 'R': 'f3', 'S': 'f4',
+}
+
+# first parameters of CSI ... ~ sequences
+_TILDE = {
+    1: 'home', 2: 'insert', 3: 'delete', 4: 'end', 5: 'pageup', 6: 'pagedown',
+    7: 'home', 8: 'end', 11: 'f1', 12: 'f2', 13: 'f3', 14: 'f4', 15: 'f5',
+    17: 'f6', 18: 'f7', 19: 'f8', 20: 'f9', 21: 'f10', 23: 'f11', 24: 'f12',
+}
+
+PASTE_START = '\x1b[200~'
+PASTE_END = '\x1b[201~'
+
+def _modifiers(m):
+    # xterm encodes modifiers as 1 + (shift | alt << 1 | ctrl << 2)
+    m -= 1
+    return ('ctrl-' if m & 4 else '') + ('alt-' if m & 2 else '') + ('shift-' if m & 1 else '')
+
+def _params(s):
+    try:
+        return [int(p) if p else 0 for p in s.split(';')]
+    except ValueError:
+        return None
+
+class KeyDecoder:
+    """Decodes terminal input into Keys, incrementally.
+
+    Bytes are fed in chunks as they are read and all keys complete so far
+    are returned; incomplete sequences are kept for the next chunk. An ESC
+    which might start a sequence is only reported (as 'escape') by flush(),
+    which should be called when no more input came for a short while.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._buffer = ''
+
+    @property
+    def pending(self):
+        return bool(self._buffer)
+
+    def feed(self, data):
+        self._buffer += self._decoder.decode(data)
+        keys = []
+        buf = self._buffer
+        k = 0
+        while k < len(buf):
+            c = buf[k]
+            if c != '\x1b':
+                # runs of ordinary characters are the common case
+                end = k + 1
+                while end < len(buf) and buf[end] >= ' ' and buf[end] != '\x7f':
+                    end += 1
+                if c >= ' ' and c != '\x7f':
+                    keys.extend(Key(ch) for ch in buf[k:end])
+                    k = end
+                else:
+                    keys.append(Key(_CONTROL.get(c, c)))
+                    k += 1
+                continue
+            key, end = self._escape(buf, k)
+            if end is None:
+                break # incomplete
+            if key is not None:
+                keys.append(key)
+            k = end
+        self._buffer = buf[k:]
+        return keys
+
+    def flush(self):
+        """Returns what's left in the buffer as keys, taking ESC for the escape key.
+        """
+
+        keys = []
+        while self._buffer:
+            if self._buffer.startswith(PASTE_START):
+                keys.append(Key('paste', text=self._buffer[len(PASTE_START):]))
+                self._buffer = ''
+                break
+            keys.append(Key('escape'))
+            self._buffer = self._buffer[1:]
+            keys.extend(self.feed(b''))
+        return keys
+
+    def _escape(self, buf, k):
+        """Decodes the sequence starting with ESC at buf[k]. Returns (key,
+        end), key is None for sequences which are ignored and end is None
+        if the sequence is incomplete.
+        """
+
+        if k + 1 == len(buf):
+            return (None, None)
+        c = buf[k + 1]
+        if c == '[':
+            return self._csi(buf, k)
+        if c == 'O':
+            if k + 2 == len(buf):
+                return (None, None)
+            name = _FINAL.get(buf[k + 2])
+            return (Key(name) if name else Key(buf[k:k + 3]), k + 3)
+        if c == '\x1b':
+            return (Key('escape'), k + 1)
+        key = _CONTROL.get(c, c)
+        return (Key('alt-' + key if not key.startswith('ctrl-') else 'ctrl-alt-' + key[5:]), k + 2)
+
+    def _csi(self, buf, k):
+        if buf.startswith(PASTE_START, k):
+            start = k + len(PASTE_START)
+            end = buf.find(PASTE_END, start)
+            if end < 0:
+                return (None, None)
+            return (Key('paste', text=buf[start:end]), end + len(PASTE_END))
+        end = k + 2
+        while end < len(buf) and not ('@' <= buf[end] <= '~'):
+            end += 1
+        if end == len(buf):
+            return (None, None)
+        body, final = buf[k + 2:end], buf[end]
+        seq = buf[k:end + 1]
+        end += 1
+        if body.startswith('<') and final in 'Mm':
+            return (self._mouse(body[1:], final), end)
+        params = _params(body)
+        if params is None:
+            return (Key(seq), end)
+        mods = _modifiers(params[1]) if len(params) > 1 else ''
+        if final == '~':
+            name = _TILDE.get(params[0])
+        elif final == 'Z':
+            name = 'tab'
+            mods = 'shift-'
+        else:
+            name = _FINAL.get(final)
+        if not name:
+            return (Key(seq), end)
+        return (Key(mods + name), end)
+
+    def _mouse(self, body, final):
+        params = _params(body)
+        if not params or len(params) != 3:
+            return None
+        b, x, y = params
+        mods = _modifiers(1 + ((b >> 2) & 1) + (((b >> 3) & 1) << 1) + (((b >> 4) & 1) << 2))
+        button = b & 3
+        if b & 64:
+            name = 'scroll-up' if button == 0 else 'scroll-down'
+        elif b & 32:
+            name = 'mouse-drag'
+        elif final == 'M':
+            name = 'mouse-press'
+        else:
+            name = 'mouse-release'
+        return Key(mods + name, mouse=(button, y - 1, x - 1))
+
+def collapse(keys, names):
+    """Merges runs of the same key into one key with repeat set, for keys
+    whose names are in names (and whose handlers honour repeat).
+    """
+
+    out = []
+    for key in keys:
+        if out and key in names and key == out[-1] and key.text is None and key.mouse is None:
+            prev = out[-1]
+            out[-1] = Key(prev, prev.repeat + key.repeat)
+        else:
+            out.append(key)
+    return out
@@ -1,26 +1,139 @@
 import tulip
+from operator import itemgetter
+
+# bumped whenever a key is bound or unbound, see KeypressMixin.key_table
+_bindings_version = 0
+
+def bindings_changed():
+    global _bindings_version
+    _bindings_version += 1
+
+def _changing(method):
+    def changed(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        bindings_changed()
+        return result
+    return changed
+
+class KeyHandlers(dict):
+    """The key handlers of a widget: a dict which tells key tables when it changes.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = _changing(dict.__setitem__)
+    __delitem__ = _changing(dict.__delitem__)
+    pop = _changing(dict.pop)
+    popitem = _changing(dict.popitem)
+    setdefault = _changing(dict.setdefault)
+    update = _changing(dict.update)
+    clear = _changing(dict.clear)
+    __ior__ = _changing(dict.__ior__)
 
 class UnhandledKeyError(RuntimeError):
     pass
 
+def _delegate(w, key):
+    # a widget with its own keypress() handles the rest of the way up
+    try:
+        w.keypress(key)
+    except UnhandledKeyError:
+        return False
+    return True
+
 class KeypressMixin:
+    __slots__ = ('_key_handlers', '_key_table', '_key_table_version', '_key_path')
+
     def __init__(self):
         super().__init__()
-        self.key_handlers = {}
+        self._key_handlers = None # until a key is bound
+        self._key_table = None
+        self._key_table_version = -1
+        self._key_path = None
+
+    @property
+    def key_handlers(self):
+        """The dict of key: (handler, help_msg), created when first needed.
+        """
+
+        if self._key_handlers is None:
+            self._key_handlers = KeyHandlers()
+        return self._key_handlers
+
+    @key_handlers.setter
+    def key_handlers(self, handlers):
+        self._key_handlers = KeyHandlers(handlers)
+        bindings_changed()
 
     def onkey(self, key, handler, help_msg = None):
         self.key_handlers[key] = (handler, help_msg)
 
+    def unbind(self, key):
+        if self._key_handlers and key in self._key_handlers:
+            del self._key_handlers[key]
+
+    def _key_path_valid(self):
+        w = self
+        for p in self._key_path:
+            if w.parent is not p:
+                return False
+            w = p
+        return True
+
+    def key_table(self):
+        """Returns the handlers of keys pressed in this widget, as a dict of
+        lists of (depth, widget, handler) from this widget up to the root,
+        and a list of the same for widgets which handle any key (those which
+        override handle_keypress, or keypress on the way up).
+
+        The table is cached along with the path to the root it was built
+        for, so it's only rebuilt when a key is bound or the widget moves.
+        """
+
+        if self._key_table_version != _bindings_version or not self._key_path_valid():
+            table = {}
+            generic = []
+            path = []
+            w = self
+            depth = 0
+            while w:
+                cls = type(w)
+                if w is not self and cls.keypress is not KeypressMixin.keypress:
+                    generic.append((depth, w, _delegate))
+                    break
+                if cls.handle_keypress is not KeypressMixin.handle_keypress:
+                    generic.append((depth, w, cls.handle_keypress))
+                elif w._key_handlers:
+                    for key, (handler, _) in w._key_handlers.items():
+                        table.setdefault(key, []).append((depth, w, handler))
+                w = w.parent
+                path.append(w)
+                depth += 1
+            self._key_table = (table, generic)
+            self._key_path = tuple(path)
+            self._key_table_version = _bindings_version
+        return self._key_table
+
     def handle_keypress(self, key):
-        if key in self.key_handlers:
-            handler, _ = self.key_handlers[key]
+        if self._key_handlers and key in self._key_handlers:
+            handler, _ = self._key_handlers[key]
             return handler(self, key)
         return None
 
+    def try_keypress(self, key):
+        """Calls handlers of key from this widget up until one returns a true
+        value. Returns whether any did.
+        """
+
+        table, generic = self.key_table()
+        handlers = table.get(key, ())
+        if generic:
+            handlers = sorted(handlers + generic, key=itemgetter(0)) if handlers else generic
+        for _, w, handler in handlers:
+            if handler(w, key):
+                return True
+        return False
+
     def keypress(self, key):
-        ret = self.handle_keypress(key)
-        if not ret:
-            if self.parent:
-                self.parent.keypress(key)
-            else:
-                raise UnhandledKeyError("Key not bound: {}".format(key))
+        if not self.try_keypress(key):
+            raise UnhandledKeyError("Key not bound: {}".format(key))
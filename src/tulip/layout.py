@@ -1,6 +1,7 @@
 from math import inf
 from enum import Enum
 import tulip
+from tulip.index import SizeIndex, MaxIndex
 
 class HAlign(Enum):
     LEFT = 1
@@ -30,8 +31,23 @@ class Cell:
             raise ValueError('min_height must be less than or equal to max_height')
 
 class CellGroup:
-    def __init__(self):
-        super().__init__()
+    """A group of widgets placed into the layout's cells (a row or a column).
+
+    Children are rendered through viewports sized by the cells. The viewports
+    are created once per child and kept, so that they remember their sizes.
+    When the cells change size, the layout only bumps its generation and
+    each group refits its viewports the next time it's used.
+
+    Like Layout, a mixin without slots of its own: classes using it declare
+    '_viewports', '_layout' and '_cell_generation'.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *args):
+        self._viewports = []
+        self._cell_generation = -1
+        super().__init__(*args)
         self._layout = None
 
     @property
@@ -41,7 +57,68 @@ class CellGroup:
             self._layout = self.lookup(Layout)
         return self._layout
 
+    def _fit_cells(self):
+        generation = self.layout._cell_generation
+        if self._cell_generation != generation:
+            self._cell_generation = generation
+            if self._refit_viewports():
+                # not invalidate(), the layout knows the sizes changed
+                self._index = None
+                self._size = None
+
+    def render(self, screen, y, x, i, j, rows, cols):
+        self._fit_cells()
+        return super().render(screen, y, x, i, j, rows, cols)
+
+    @property
+    def rendered_widgets(self):
+        self._fit_cells()
+        viewports = self._viewports
+        for idx in range(len(viewports), len(self._children)):
+            viewport = Viewport(self._children[idx])
+            self._fit_viewport(viewport, self.layout.cells[idx])
+            viewports.append(viewport)
+        return viewports
+
+    def insert_child(self, k, child):
+        if k < len(self._viewports):
+            self._viewports.insert(k, Viewport(child))
+            self._refit_viewports(k)
+        super().insert_child(k, child)
+
+    def remove_child(self, child):
+        k = self.child_index(child)
+        if k < len(self._viewports):
+            del self._viewports[k]
+            self._refit_viewports(k)
+        super().remove_child(child)
+
+    def _refit_viewports(self, start = 0):
+        """Fits the viewports to the cells. Returns whether any changed.
+        """
+
+        changed = False
+        for viewport, cell in zip(self._viewports[start:], self.layout.cells[start:]):
+            changed |= self._fit_viewport(viewport, cell)
+        return changed
+
+    def clear_children(self):
+        self._viewports.clear()
+        super().clear_children()
+
+    def child_invalidated(self, child):
+        idx = self.child_index(child)
+        if idx < len(self._viewports):
+            self._viewports[idx].invalidate()
+        super().child_invalidated(child)
+
+    def reindex(self):
+        self._refit_viewports()
+        super().reindex()
+
 class Viewport(tulip.Widget):
+    __slots__ = ('widget', 'rows', 'cols', 'halign')
+
     def __init__(self, widget, rows=None, cols=None, halign=HAlign.LEFT):
         super().__init__()
         self.widget = widget
@@ -73,30 +150,95 @@ class Viewport(tulip.Widget):
         tulip.print_indented("Viewport (rows={}, cols={}) of:".format(self.rows, self.cols), indent)
         self.widget.print_tree(indent + 1)
 
-class Row(tulip.HContainer, CellGroup):
+class Row(CellGroup, tulip.HContainer):
+    __slots__ = ('_viewports', '_layout', '_cell_generation')
+
     def __init__(self, children = None):
         super().__init__(children or [])
 
-    @property
-    def rendered_widgets(self):
-        widgets = []
-        for idx, w in enumerate(super().rendered_widgets):
-            c = self.layout.cells[idx]
-            widgets.append(Viewport(w, cols=c.width, halign=c.halign))
-        return widgets
+    def _fit_viewport(self, viewport, cell):
+        if viewport.cols != cell.width or viewport.halign != cell.halign:
+            viewport.cols = cell.width
+            viewport.halign = cell.halign
+            viewport._size = None
+            return True
+        return False
+
+class Column(CellGroup, tulip.VContainer):
+    __slots__ = ('_viewports', '_layout', '_cell_generation')
 
-class Column(tulip.VContainer, CellGroup):
     def __init__(self, children = None):
         super().__init__(children or [])
 
-    @property
-    def rendered_widgets(self):
-        return [Viewport(widget, rows=self.layout.cells[idx].height) for idx, widget in enumerate(super().rendered_widgets)]
+    def _fit_viewport(self, viewport, cell):
+        if viewport.rows != cell.height:
+            viewport.rows = cell.height
+            viewport._size = None
+            return True
+        return False
+
+class CellIndex:
+    """Sizes of a layout's cell groups (in direction a) and of their cells'
+    contents (in direction b), indexed so that maximum cell sizes over any
+    window of consecutive groups can be found in O(log n) per cell.
+    """
+
+    def __init__(self, a, b, num_cells):
+        self.a = a
+        self.b = b
+        self.groups = []
+        self.positions = {}
+        self.extents = SizeIndex()
+        self.maxima = [MaxIndex() for _ in range(num_cells)]
+
+    def _content_sizes(self, cell_group):
+        sizes = [cell_content.size[self.b] for cell_content in cell_group._children]
+        return sizes + [0] * (len(self.maxima) - len(sizes))
+
+    def append(self, cell_group):
+        self.positions[cell_group] = len(self.groups)
+        self.groups.append(cell_group)
+        self.extents.append(cell_group.size[self.a])
+        for maxima, size in zip(self.maxima, self._content_sizes(cell_group)):
+            maxima.append(size)
+
+    def update(self, cell_group):
+        k = self.positions[cell_group]
+        self.extents.update(k, cell_group.size[self.a])
+        for maxima, size in zip(self.maxima, self._content_sizes(cell_group)):
+            maxima.update(k, size)
+
+    def window(self, skip, u):
+        """Returns the range of groups which are (at least partially) within u
+        rows/columns after the first skip rows/columns.
+        """
+
+        n = len(self.groups)
+        start = self.extents.find(skip - 1)[0]
+        if u == inf:
+            return (start, n)
+        stop = self.extents.find(self.extents.prefix(start) + u - 1)[0] + 1
+        return (start, min(max(stop, start + 1), n))
+
+    def max_cell_size(self, skip, u):
+        start, stop = self.window(skip, u)
+        return [maxima.query(start, stop) for maxima in self.maxima]
+
+_LAYOUT_SLOTS = ('_cells', '_cell_index', '_cell_index_children', '_dirty_cell_groups',
+    '_cell_generation', 'whole_table')
 
 class Layout:
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self._cells = []
+        self._cell_index = None
+        self._cell_index_children = 0
+        self._dirty_cell_groups = set()
+        self._cell_generation = 0 # bumped when the cells change size, see CellGroup
+        # size the cells by all groups rather than by those which are rendered
+        self.whole_table = False
 
     @property
     def cells(self):
@@ -104,26 +246,52 @@ class Layout:
 
     def add_cell(self, cell):
         self._cells.append(cell)
+        self._cell_index = None
+
+    def insert_child(self, k, child):
+        self._cell_index = None
+        super().insert_child(k, child)
+
+    def remove_child(self, child):
+        self._cell_index = None
+        super().remove_child(child)
+
+    def clear_children(self):
+        self._cell_index = None
+        super().clear_children()
+
+    def child_invalidated(self, child):
+        if self._cell_index:
+            if child in self._cell_index.positions:
+                self._dirty_cell_groups.add(child)
+            else:
+                self._cell_index = None
+        super().child_invalidated(child)
+
+    def _get_cell_index(self, a, b):
+        index = self._cell_index
+        if not index or index.b != b:
+            index = self._cell_index = CellIndex(a, b, len(self.cells))
+            self._cell_index_children = 0
+        else:
+            for cell_group in self._dirty_cell_groups:
+                index.update(cell_group)
+        self._dirty_cell_groups.clear()
+        for child in self._children[self._cell_index_children:]:
+            for cell_group in child.srch(CellGroup, True):
+                index.append(cell_group)
+        self._cell_index_children = len(self._children)
+        return index
 
     def _max_cell_size_generic(self, b, skip, u):
-        a = 1 - b
-        sum_a = 0
-        sum_a2 = 0
-        cell_size = [0] * len(self.cells)
-        for cell_group in self.srch(CellGroup, True):
-            sum_a += cell_group.size[a]
-            if sum_a < skip:
-                continue
-            sum_a2 += cell_group.size[a]
-            for idx, cell_content in enumerate(cell_group._children):
-                cell_size[idx] = max(cell_size[idx], cell_content.size[b])
-            if sum_a2 >= u:
-                break
-        return cell_size
-
-    def _set_cell_sizes_generic(self, target_size, b, skip, u):
+        return self._get_cell_index(1 - b, b).max_cell_size(skip, u)
+
+    def _set_cell_sizes_generic(self, screen, target_size, b, skip, u):
+        if self.whole_table:
+            skip, u = 0, inf
         max_cell_size = self._max_cell_size_generic(b, skip, u)
         cells_total = sum(max_cell_size)
+        old_sizes = [(cell.height, cell.width) for cell in self.cells]
         for idx, cell in enumerate(self.cells):
             cell_size = [None, None]
             cell_max_size = [cell.max_height, cell.max_width]
@@ -143,30 +311,40 @@ class Layout:
                     cell_size[b] += int(avail_size * (cell.weight / sum_weight))
                     cell.height = cell_size[0]
                     cell.width = cell_size[1]
+        if old_sizes != [(cell.height, cell.width) for cell in self.cells]:
+            # cell groups refit their viewports when they're rendered
+            self._cell_generation += 1
+            if screen.clip is not None:
+                # groups outside of the damage moved too
+                screen.layout_changed = True
 
     def _measure_generic(self, a, b):
         sum_max_b = sum(self._max_cell_size_generic(b, 0, inf))
-        sum_a = sum(child.size[a] for child in self._children)
+        sum_a = self._size_index(a).total
         return (sum_a, sum_max_b)
 
 
 class ColumnLayout(Layout, tulip.VContainer):
+    __slots__ = _LAYOUT_SLOTS
+
     def __init__(self):
         super().__init__()
 
     def _render(self, screen, y, x, i, j, rows, cols):
-        self._set_cell_sizes_generic(cols, 1, i, rows)
+        self._set_cell_sizes_generic(screen, cols, 1, i, rows)
         return super()._render(screen, y, x, i, j, rows, cols)
 
     def _measure(self):
         return self._measure_generic(0, 1)
 
 class RowLayout(Layout, tulip.HContainer):
+    __slots__ = _LAYOUT_SLOTS
+
     def __init__(self):
         super().__init__()
 
     def _render(self, screen, y, x, i, j, rows, cols):
-        self._set_cell_sizes_generic(rows, 0, j, cols)
+        self._set_cell_sizes_generic(screen, rows, 0, j, cols)
         return super()._render(screen, y, x, i, j, rows, cols)
 
     def _measure(self):
@@ -0,0 +1,48 @@
+import os
+import select
+
+class Sink:
+    """Where the frames rendered by AnsiScreen go. A frame is written by a single write() call.
+    """
+
+    def write(self, data):
+        raise NotImplementedError()
+
+class FdSink(Sink):
+    def __init__(self, fd = 1):
+        self.fd = fd
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                # the fd is non-blocking and full (a slow terminal), wait until it drains
+                select.select([], [self.fd], [])
+
+class SocketSink(Sink):
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+class BufferSink(Sink):
+    """Collects all output in memory, useful for tests.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.num_writes = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.num_writes += 1
+
+    def getvalue(self):
+        return bytes(self.buffer)
+
+class NullSink(Sink):
+    def write(self, data):
+        pass
@@ -1,7 +1,12 @@
-import tulip
+import codecs
 import math
+import os
+import tulip
+from tulip.width import clip, text_width
 
 class Pager(tulip.VContainer):
+    __slots__ = ('_vscroll',)
+
     def __init__(self, children=[]):
         super().__init__(children)
         self._vscroll = 0
@@ -12,7 +17,12 @@ class Pager(tulip.VContainer):
 
     @vscroll.setter
     def vscroll(self, s):
-        self._vscroll = self._page_align(s)
+        s = self._page_align(s)
+        if s != self._vscroll:
+            self._vscroll = s
+            if self.render_args:
+                screen, y, x, _, _, rows, cols = self.render_args
+                screen.damage(y, x, rows, cols)
 
     def _render(self, screen, y, x, i, j, rows, cols):
         return super()._render(screen, y, x, i + self.vscroll, j, rows, cols)
@@ -27,12 +37,12 @@ class Pager(tulip.VContainer):
             return n - (n % self._avail_rows())
         return 0
 
-    def next_page(self):
+    def next_page(self, n = 1):
         rows, _ = self.size
-        self.vscroll = max(0, min(rows - 1, self.vscroll + self._avail_rows()))
+        self.vscroll = max(0, min(rows - 1, self.vscroll + n * self._avail_rows()))
 
-    def prev_page(self):
-        self.vscroll = max(0, self.vscroll - self._avail_rows())
+    def prev_page(self, n = 1):
+        self.vscroll = max(0, self.vscroll - n * self._avail_rows())
 
     def scroll_to_widget(self, w):
         self.vscroll = w.offset_to(self)[0]
@@ -46,3 +56,136 @@ class Pager(tulip.VContainer):
         if self._avail_rows():
             return 1 + int(self.vscroll / self._avail_rows())
         return 0
+
+class StreamPager(Pager):
+    """A Pager following a stream of lines, such as a growing log file.
+
+    At most max_lines of the latest lines are kept, in a ring buffer; older
+    ones are dropped. Lines are drawn directly rather than by Text children,
+    so appending one is O(1) no matter how many there are. While follow is
+    set, the last page is shown; scrolling up clears it and scrolling down
+    to the end sets it again.
+
+    Lines come from extend() (any iterable of lines), feed() (chunks of
+    text or bytes, split at newlines) or read_fd() (non-blocking reads).
+    The width is that of the widest line seen so far.
+    """
+
+    READ_SIZE = 65536
+
+    def __init__(self, max_lines = 10000, follow = True):
+        super().__init__()
+        self.max_lines = max_lines
+        self.follow = follow
+        self.num_evicted = 0
+        self._ring = []
+        self._start = 0
+        self._cols = 0
+        self._partial = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def __len__(self):
+        return len(self._ring)
+
+    def line(self, k):
+        """Returns the k-th line kept (0 is the oldest one).
+        """
+
+        return self._ring[(self._start + k) % len(self._ring)]
+
+    def append(self, line):
+        ring = self._ring
+        if len(ring) < self.max_lines:
+            ring.append(line)
+        else:
+            ring[self._start] = line
+            self._start = (self._start + 1) % len(ring)
+            self.num_evicted += 1
+            if not self.follow and self._vscroll > 0:
+                self._vscroll -= 1 # keep the same lines in view
+        width = text_width(line)
+        if width > self._cols:
+            self._cols = width
+        # once invalidated, more lines change nothing until it's measured or rendered
+        if self._size is not None or (self.render_args and not self._damage_pending):
+            self.invalidate()
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def feed(self, data):
+        if isinstance(data, bytes):
+            data = self._decoder.decode(data)
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        self.extend(lines)
+
+    def read_fd(self, fd):
+        """Reads what's available from a non-blocking fd. Returns False at the end of the file.
+        """
+
+        try:
+            data = os.read(fd, self.READ_SIZE)
+        except BlockingIOError:
+            return True
+        if not data:
+            if self._partial:
+                self.append(self._partial)
+                self._partial = ''
+            return False
+        self.feed(data)
+        return True
+
+    def clear(self):
+        self._ring = []
+        self._start = 0
+        self._cols = 0
+        self._vscroll = 0
+        self.invalidate()
+
+    def _last_top(self):
+        return max(0, len(self._ring) - self._avail_rows())
+
+    def _top(self):
+        return self._last_top() if self.follow else self._vscroll
+
+    def _page_align(self, n):
+        return max(0, min(n, self._last_top()))
+
+    def _scroll_to(self, top, follow):
+        top = self._page_align(top)
+        if top != self._top() or follow != self.follow:
+            self._vscroll = top
+            self.follow = follow
+            self.damage()
+
+    def next_page(self, n = 1):
+        top = self._top() + n * self._avail_rows()
+        self._scroll_to(top, top >= self._last_top())
+
+    def prev_page(self, n = 1):
+        self._scroll_to(self._top() - n * self._avail_rows(), False)
+
+    def scroll_to_end(self):
+        self._scroll_to(self._last_top(), True)
+
+    def page(self):
+        if self._avail_rows():
+            return 1 + int(self._top() / self._avail_rows())
+        return 0
+
+    def _measure(self):
+        return (len(self._ring), self._cols)
+
+    def _render(self, screen, y, x, i, j, rows, cols):
+        top = (max(0, len(self._ring) - rows) if self.follow else self._vscroll) + i
+        nrows = max(0, min(rows, len(self._ring) - top))
+        style = screen.style_id(self.resulting_classes)
+        runs = []
+        for k in range(0, nrows):
+            text = clip(self.line(top + k), j, cols)
+            if text:
+                runs.append((y + k, x, text, style))
+        screen.put_runs(runs)
+        return (nrows, max((text_width(run[2]) for run in runs), default=0))
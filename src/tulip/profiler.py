@@ -0,0 +1,166 @@
+import sys
+import time
+import tulip
+from tulip.screen import Screen
+
+def _subclasses(cls):
+    yield cls
+    for c in cls.__subclasses__():
+        yield from _subclasses(c)
+
+class WidgetStats:
+    def __init__(self, name):
+        self.name = name
+        self.renders = 0
+        self.measures = 0
+        self.time = 0.0
+        self.self_time = 0.0
+        self.size_hits = 0
+        self.size_misses = 0
+        self.puts = 0
+
+class Profiler:
+    """Records what rendering and measuring of widgets costs, per widget class and per instance.
+
+    While enabled, _render and _measure of all widget classes, Widget.size
+    and put_runs of all screens are wrapped; disabling the profiler puts the
+    original methods back, so it costs nothing when not in use. Classes
+    defined after enable() are not profiled.
+
+        with Profiler() as p:
+            root.render(screen, 0, 0, 0, 0, rows, cols)
+        p.report()
+
+    Time is cumulative (includes children) and self (excludes them); the
+    cumulative time of a class includes nested widgets of the same class.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.by_class = {}
+        self.by_instance = {}
+        self.stacks = {}
+        self._stack = []
+        self._patched = []
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    @property
+    def enabled(self):
+        return bool(self._patched)
+
+    def reset(self):
+        self.by_class.clear()
+        self.by_instance.clear()
+        self.stacks.clear()
+
+    def _patch(self, cls, name, f):
+        self._patched.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, f)
+
+    def enable(self):
+        if self.enabled:
+            return
+        for cls in _subclasses(tulip.Widget):
+            for name in ('_render', '_measure'):
+                if name in cls.__dict__:
+                    self._patch(cls, name, self._wrap_call(cls.__dict__[name], name))
+        self._patch(tulip.Widget, 'size', self._wrap_size(tulip.Widget.__dict__['size']))
+        for cls in _subclasses(Screen):
+            if 'put_runs' in cls.__dict__:
+                self._patch(cls, 'put_runs', self._wrap_put(cls.__dict__['put_runs']))
+
+    def disable(self):
+        while self._patched:
+            cls, name, f = self._patched.pop()
+            setattr(cls, name, f)
+        self._stack.clear()
+
+    def _stats(self, w):
+        name = type(w).__name__
+        c = self.by_class.get(name)
+        if not c:
+            c = self.by_class[name] = WidgetStats(name)
+        i = self.by_instance.get(id(w))
+        if not i:
+            i = self.by_instance[id(w)] = WidgetStats('{}@{:x}'.format(name, id(w)))
+        return (c, i)
+
+    def _wrap_call(self, f, kind):
+        prof = self
+        def wrapper(w, *args):
+            stack = prof._stack
+            if stack and stack[-1][0] is w and stack[-1][1] == kind:
+                return f(w, *args) # super() call of the same widget
+            path = (stack[-1][4] if stack else ()) + (type(w).__name__,)
+            frame = [w, kind, prof.clock(), 0.0, path]
+            stack.append(frame)
+            try:
+                return f(w, *args)
+            finally:
+                stack.pop()
+                elapsed = prof.clock() - frame[2]
+                self_time = elapsed - frame[3]
+                if stack:
+                    stack[-1][3] += elapsed
+                for s in prof._stats(w):
+                    if kind == '_render':
+                        s.renders += 1
+                    else:
+                        s.measures += 1
+                    s.time += elapsed
+                    s.self_time += self_time
+                prof.stacks[path] = prof.stacks.get(path, 0.0) + self_time
+        wrapper.__wrapped__ = f
+        return wrapper
+
+    def _wrap_size(self, prop):
+        prof = self
+        def size(w):
+            hit = w._size is not None
+            for s in prof._stats(w):
+                if hit:
+                    s.size_hits += 1
+                else:
+                    s.size_misses += 1
+            return prop.fget(w)
+        return property(size)
+
+    def _wrap_put(self, f):
+        prof = self
+        def put_runs(screen, runs):
+            if prof._stack:
+                for s in prof._stats(prof._stack[-1][0]):
+                    s.puts += len(runs)
+            return f(screen, runs)
+        put_runs.__wrapped__ = f
+        return put_runs
+
+    def report(self, file=None, limit=20, key='self_time', instances=True):
+        """Prints the most expensive widget classes (and instances) sorted by key.
+        """
+
+        file = file or sys.stdout
+        tables = [('class', self.by_class)]
+        if instances:
+            tables.append(('instance', self.by_instance))
+        for title, stats in tables:
+            print('{:32} {:>8} {:>8} {:>10} {:>10} {:>8} {:>8} {:>8}'.format(
+                title, 'renders', 'measures', 'cum ms', 'self ms', 'hits', 'misses', 'puts'), file=file)
+            for s in sorted(stats.values(), key=lambda s: getattr(s, key), reverse=True)[:limit]:
+                print('{:32} {:8} {:8} {:10.3f} {:10.3f} {:8} {:8} {:8}'.format(
+                    s.name, s.renders, s.measures, 1000 * s.time, 1000 * s.self_time,
+                    s.size_hits, s.size_misses, s.puts), file=file)
+
+    def dump_stacks(self, file):
+        """Writes self times (in microseconds) of widget class stacks in the
+        folded format understood by flamegraph.pl and speedscope.
+        """
+
+        for path, t in sorted(self.stacks.items()):
+            file.write('{} {}\n'.format(';'.join(path), round(1e6 * t)))
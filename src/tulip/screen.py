@@ -1,30 +1,149 @@
+from tulip.grid import CellGrid, WIDE_TAIL, cells
+
+def _intersects(r, y, x, rows, cols):
+    return r[0] < y + rows and y < r[0] + r[2] and r[1] < x + cols and x < r[1] + r[3]
+
+def _contains(r, y, x, rows, cols):
+    return r[0] <= y and y + rows <= r[0] + r[2] and r[1] <= x and x + cols <= r[1] + r[3]
+
 class Screen:
+    """Keeps the cells put to the screen in a grid and tracks damaged
+    rectangles for partial redraws (see Widget.repaint).
+
+    While repainting, clip is the list of rectangles being redrawn: the
+    content in them has been erased and puts outside of them are dropped.
+
+    on_change, if set, is called whenever something needs to be repainted.
+    """
+
     def __init__(self):
+        self.damaged = []
+        self.invalidated = []
+        self.clip = None
+        self.layout_changed = False
+        self.on_change = None
+
+    def damage(self, y, x, rows, cols):
+        if rows > 0 and cols > 0 and (y, x, rows, cols) not in self.damaged:
+            self.damaged.append((y, x, rows, cols))
+            if self.on_change:
+                self.on_change()
+
+    def add_invalidated(self, widget):
+        self.invalidated.append(widget)
+        if self.on_change:
+            self.on_change()
+
+    def _forget_invalidated(self):
+        # everything is going to be rendered anew
+        for widget in self.invalidated:
+            widget._damage_pending = False
+        self.invalidated.clear()
+
+    def render(self):
+        """Outputs what was put to the screen, if there's anywhere to output it to.
+        """
+
         pass
 
+    def is_damaged(self, y, x, rows, cols):
+        return any(_intersects(r, y, x, rows, cols) for r in self.clip)
+
+    def is_covered(self, y, x, rows, cols):
+        return rows <= 0 or cols <= 0 or any(_contains(r, y, x, rows, cols) for r in self.clip)
+
+    def begin_repaint(self):
+        self.clip = self.damaged
+        self.damaged = []
+        self.layout_changed = False
+        for r in self.clip:
+            self.erase(*r)
+
+    def end_repaint(self):
+        self.clip = None
+
+    def _clipped(self, y, x, codes):
+        """Yields the (x, cells) pieces of a put which fall into the clip rectangles.
+        """
+
+        for r in self.clip:
+            if r[0] <= y < r[0] + r[2]:
+                x0 = max(x, r[1])
+                x1 = min(x + len(codes), r[1] + r[3])
+                if x0 < x1:
+                    yield (x0, codes[x0 - x:x1 - x])
+
+    def style_id(self, classes):
+        """Returns the id of the style of classes, for put_runs() and fill().
+        """
+
+        return 0
+
+    def put(self, y, x, text, classes):
+        self.put_runs(((y, x, text, self.style_id(classes)),))
+
+    def put_runs(self, runs):
+        """Puts a sequence of (y, x, text, style_id) runs at once.
+        """
+
+        grid, layer, clip = self.grid, self.layer, self.clip
+        for y, x, text, style in runs:
+            if y < 0 or y >= self.nrows or x < 0 or x >= self.ncols:
+                raise RuntimeError('attempted to put a string off the screen')
+            if clip is None:
+                grid.put(y, x, text, style, layer)
+            else:
+                for x_, codes in self._clipped(y, x, cells(text)):
+                    grid.put_cells(y, x_, codes, style, layer)
+
+    def fill(self, y0, x, rows, cols, style):
+        """Fills a rectangle with blanks of the given style, in one go.
+        """
+
+        grid, layer = self.grid, self.layer
+        if self.clip is None:
+            grid.fill(y0, x, rows, cols, grid.blank, style, layer)
+            return
+        for r in self.clip:
+            y1, x1 = max(y0, r[0]), max(x, r[1])
+            y2, x2 = min(y0 + rows, r[0] + r[2]), min(x + cols, r[1] + r[3])
+            if y1 < y2 and x1 < x2:
+                grid.fill(y1, x1, y2 - y1, x2 - x1, grid.blank, style, layer)
+
+    def draw_rectangle(self, y0, x, rows, cols, classes):
+        self.fill(y0, x, rows, cols, self.style_id(classes))
+
+    def erase(self, y0, x, rows, cols):
+        self.grid.erase(y0, x, rows, cols)
+
 class MockScreen(Screen):
     def __init__(self, nrows, ncols):
         super().__init__()
         self.nrows = nrows
         self.ncols = ncols
-        self.rows = None
+        self.grid = CellGrid(nrows, ncols)
         self.clear()
         self.layer = 0
 
     def clear(self):
-        self.rows = [''] * self.nrows
-
-    def put(self, y, x, text, classes):
-        if y < 0 or y >= self.nrows or x < 0 or x >= self.ncols:
-            raise RuntimeError('attempted to put a string off the screen')
-        self.rows[y] = self.rows[y][0:x].ljust(x) + text + self.rows[y][x:]
-
-    def draw_rectangle(self, y0, x, rows, cols, classes):
-        pass
+        self.grid.clear()
+        self.damaged = []
+        self._forget_invalidated()
 
     def measure(self, widget):
         return widget.size
 
+    @property
+    def rows(self):
+        empty = chr(self.grid.blank)
+        return [self.grid.text(y, 0, self.ncols).rstrip(empty).replace(empty, ' ') for y in range(0, self.nrows)]
+
+    def snapshot(self):
+        """Returns a copy of the cells, which compares equal to another one with the same content.
+        """
+
+        return self.grid.copy()
+
     @property
     def content(self):
         return '\n'.join(self.rows)
@@ -33,7 +152,9 @@ class MockScreen(Screen):
         return self.content
 
 import os
+from collections import OrderedDict
 from enum import IntEnum
+from tulip.output import FdSink
 
 class AnsiFormat(IntEnum):
     BOLD = 1
@@ -60,11 +181,12 @@ class ColorName(IntEnum):
     WHITE = 15
 
 class Color:
-    def setfg(self):
-        self._set(True)
+    def setfg(self, screen = None):
+        (screen or AnsiScreen).write_attr(self._attr(True))
+
+    def setbg(self, screen = None):
+        (screen or AnsiScreen).write_attr(self._attr(False))
 
-    def setbg(self):
-        self._set(False)
 class Ansi256(Color):
     def __init__(self, n):
         self.n = n
@@ -72,8 +194,8 @@ class Ansi256(Color):
     def __repr__(self):
         return "Ansi256({})".format(self.n)
 
-    def _set(self, fg):
-        AnsiScreen.write_attr("{};5;{}".format(38 if fg else 48, self.n))
+    def _attr(self, fg):
+        return "{};5;{}".format(38 if fg else 48, self.n)
 
 class TrueColor(Color):
     def __init__(self, r, g, b):
@@ -84,17 +206,71 @@ class TrueColor(Color):
     def __repr__(self):
         return "TrueColor({}, {}, {})".format(self.r, self.g, self.b)
 
-    def _set(self, fg):
-        AnsiScreen.write_attr("{};2;{};{};{}".format(38 if fg else 48, self.r, self.g, self.b))
+    def _attr(self, fg):
+        return "{};2;{};{};{}".format(38 if fg else 48, self.r, self.g, self.b)
+
+def _sgr(fg, bg, fmt):
+    """Returns the escape sequence which sets the attributes (from scratch).
+    """
+
+    attrs = ['0']
+    if fg:
+        attrs.append(fg._attr(True))
+    if bg:
+        attrs.append(bg._attr(False))
+    if fmt:
+        attrs.append(str(int(fmt)))
+    return bytes('\x1b[{}m'.format(';'.join(attrs)), 'ascii')
+
+DEFAULT_STYLE = (None, None, None)
 
 class Theme:
+    """Resolves classes to (fg, bg, fmt) styles. Styles are numbered, the
+    ids never change; _sgr holds the escape sequence of each.
+    """
+
+    CACHE_SIZE = 1024
+
     def __init__(self):
         self.classes = {}
+        self.styles = [DEFAULT_STYLE]
+        self._sgr = [_sgr(*DEFAULT_STYLE)]
+        self._style_ids = {self._sgr[0]: 0}
+        self._cache = OrderedDict()
+        # the last classes looked up, usually the same (interned) tuple as the next ones
+        self._last = (None, 0)
 
     def set_class(self, name, fg = None, bg = None, fmt = None):
         self.classes[name] = (fg, bg, fmt)
+        self._cache.clear()
+        self._last = (None, 0)
 
     def get_style(self, classes):
+        return self.styles[self.style_id(classes)]
+
+    def style_id(self, classes):
+        if classes is self._last[0]:
+            return self._last[1]
+        key = tuple(classes)
+        style_id = self._cache.get(key)
+        if style_id is not None:
+            self._cache.move_to_end(key)
+            self._last = (key, style_id)
+            return style_id
+        style = self._resolve(key)
+        sgr = _sgr(*style)
+        style_id = self._style_ids.get(sgr)
+        if style_id is None:
+            style_id = self._style_ids[sgr] = len(self.styles)
+            self.styles.append(style)
+            self._sgr.append(sgr)
+        self._cache[key] = style_id
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        self._last = (key, style_id)
+        return style_id
+
+    def _resolve(self, classes):
         fg, bg, fmt = None, None, None
         for name in classes:
             if name in self.classes:
@@ -107,13 +283,37 @@ class Theme:
                     fmt = cls_fmt
         return (fg, bg, fmt)
 
+class _frame_method:
+    """A write helper of AnsiScreen. Called on a screen, it adds to the
+    screen's frame; called on the class (the helpers used to be static),
+    it writes to fd 1 right away.
+    """
+
+    def __init__(self, method):
+        self.method = method
+
+    def __get__(self, screen, cls):
+        if screen is not None:
+            return self.method.__get__(screen, cls)
+        def write_now(*args):
+            screen = cls.__new__(cls)
+            screen.frame = bytearray()
+            self.method(screen, *args)
+            os.write(1, screen.frame)
+        return write_now
+
 class AnsiScreen(Screen):
-    def __init__(self, nrows, ncols):
+    MAX_GAP = 4
+
+    def __init__(self, nrows, ncols, sink = None):
         super().__init__()
         self.nrows = nrows
         self.ncols = ncols
-        self.rows = None
-        self.layer = 16 
+        self.grid = CellGrid(nrows, ncols, ord(' '))
+        self.front = None
+        self.sink = sink or FdSink(1)
+        self.frame = bytearray()
+        self.layer = 16
         self.theme = Theme()
         self.theme.set_class('focused', bg = Ansi256(ColorName.BLACK), fg = Ansi256(229), fmt = AnsiFormat.REVERSE)
         self.theme.set_class('error', fg = Ansi256(ColorName.RED), fmt = AnsiFormat.BOLD)
@@ -132,55 +332,116 @@ class AnsiScreen(Screen):
         self.clear()
 
     def clear(self):
-        self.rows = [[] for _ in range(0, self.nrows)]
+        self.grid.clear()
+        self.damaged = []
+        self._forget_invalidated()
+
+    @_frame_method
+    def write_cmd(self, cmd):
+        self.frame += bytes('\x1b{}'.format(cmd), 'ascii')
 
-    @staticmethod
-    def write_cmd(cmd):
-        os.write(1, bytes('\x1b{}'.format(cmd), 'ascii'))
+    @_frame_method
+    def write_attr(self, attr):
+        self.write_cmd('[{}m'.format(attr))
 
-    @staticmethod
-    def write_attr(attr):
-        AnsiScreen.write_cmd('[{}m'.format(attr))
+    @_frame_method
+    def advance(self, ncols):
+        self.write_cmd('[{}{}'.format(abs(ncols), 'D' if ncols < 0 else 'C'))
 
-    @staticmethod
-    def advance(ncols):
-        AnsiScreen.write_cmd('[{}{}'.format(abs(ncols), 'D' if ncols < 0 else 'C'))
+    @_frame_method
+    def write(self, text):
+        self.frame += bytes(text, 'utf-8')
 
-    @staticmethod
-    def write(text):
-        os.write(1, bytes(text, 'utf-8'))
+    def flush(self):
+        """Sends the frame built so far to the sink in one go.
+        """
+
+        if self.frame:
+            try:
+                self.sink.write(self.frame)
+            except BaseException:
+                self.front = None # the terminal got part of the frame at best
+                raise
+            finally:
+                self.frame.clear()
 
     def set_attrs(self, fg, bg, fmt):
         if fg:
-            fg.setfg()
+            fg.setfg(self)
         if bg:
-            bg.setbg()
+            bg.setbg(self)
         if fmt:
-            AnsiScreen.write_attr(fmt)
+            self.write_attr(fmt)
 
     def reset_attrs(self):
-        AnsiScreen.write_attr(0)
+        self.write_attr(0)
 
-    def put(self, y, x, text, classes):
-        if y < 0 or y >= self.nrows or x < 0 or x >= self.ncols:
-            raise RuntimeError('attempted to put a string off the screen')
-        self.rows[y].append((x, self.layer, text, self.theme.get_style(classes)))
+    def style_id(self, classes):
+        return self.theme.style_id(classes)
 
-    def draw_rectangle(self, y0, x, rows, cols, classes):
-        for y in range(y0, y0 + rows):
-            self.put(y, x, ' ' * cols, classes)
+    def _changed_runs(self, y):
+        chars, styles = self.grid.chars, self.grid.styles
+        old_chars, old_styles = self.front.chars, self.front.styles
+        o = y * self.ncols
+        runs = []
+        for x in range(0, self.ncols):
+            if chars[o + x] != old_chars[o + x] or styles[o + x] != old_styles[o + x]:
+                if runs and x - runs[-1][1] <= self.MAX_GAP:
+                    runs[-1][1] = x + 1
+                else:
+                    runs.append([x, x + 1])
+        return runs
+
+    def force_redraw(self):
+        """Makes the next render() repaint the whole screen, e.g. after the terminal was messed up.
+        """
+
+        self.front = None
 
     def render(self):
-        #self.write("\033[H\033[J")
-        first = True
-        for row in self.rows:
-            if not first:
-                AnsiScreen.write('\n')
-            first = False
-            xpos = 0
-            for (x, _, text, attrs) in sorted(row, key=lambda x: (x[1], x[0])):
-                AnsiScreen.write_cmd('[{}G'.format(1 + x))
-                self.set_attrs(*attrs)
-                AnsiScreen.write(text)
-                self.reset_attrs()
-        AnsiScreen.write_cmd('[?25l')
+        """Writes out the cells which changed since the last frame.
+
+        Changed cells are grouped into runs (unchanged gaps of up to MAX_GAP
+        cells are rewritten rather than skipped over), the cursor is only
+        moved between runs and attributes are only set when they change.
+        """
+
+        grid = self.grid
+        if self.front is None:
+            self.write_cmd('[H')
+            self.write_cmd('[2J')
+            self.front = CellGrid(self.nrows, self.ncols, grid.blank)
+        sgr = self.theme._sgr
+        cursor = None
+        style = None
+        for y in range(0, self.nrows):
+            if grid.row_equal(self.front, y):
+                continue
+            o = y * self.ncols
+            for x0, x1 in self._changed_runs(y):
+                # never start or end a run between the halves of a wide character
+                if grid.chars[o + x0] == WIDE_TAIL:
+                    x0 -= 1
+                if x1 < self.ncols and grid.chars[o + x1] == WIDE_TAIL:
+                    x1 += 1
+                if cursor and cursor[0] == y and cursor[1] < x0:
+                    self.advance(x0 - cursor[1])
+                elif cursor != (y, x0):
+                    self.write_cmd('[{};{}H'.format(1 + y, 1 + x0))
+                x = x0
+                while x < x1:
+                    s = grid.styles[o + x]
+                    end = x + 1
+                    while end < x1 and grid.styles[o + end] == s:
+                        end += 1
+                    if s != style:
+                        self.frame += sgr[s]
+                        style = s
+                    self.write(grid.text(y, x, end))
+                    x = end
+                cursor = (y, x1)
+        if cursor:
+            self.reset_attrs()
+            self.write_cmd('[?25l')
+        self.front.assign(grid)
+        self.flush()
@@ -1,7 +1,10 @@
 import tulip
+from tulip.width import clip, fit, text_width
 
 # Clean-up
 class Text(tulip.Widget):
+    __slots__ = ('_text',)
+
     def __init__(self, text='', classes=None):
         super().__init__()
         if text == None:
@@ -12,13 +15,12 @@ class Text(tulip.Widget):
         return "Text (size={}, text={})".format(self.size, self.text)
 
     def _measure(self):
-        return (1, len(self.text)) if self.text else (0, 0)
+        return (1, text_width(self.text)) if self.text else (0, 0)
 
     def _render(self, screen, y, x, i, j, rows, cols):
-        end = j + cols
-        text = '' if i > 0 or rows == 0 else self.text[j:end]
+        text = '' if i > 0 or rows == 0 else clip(self.text, j, cols)
         screen.put(y, x, text, self.resulting_classes)
-        cols = len(text)
+        cols = text_width(text)
         rows = 1 if cols else 0
         return (rows, cols)
 
@@ -40,23 +42,89 @@ class Text(tulip.Widget):
 
 import math
 
+def wrap(line, cols):
+    """Splits a line into pieces at most cols wide, breaking at spaces where
+    possible. Continuation pieces are marked with an arrow.
+    """
+
+    if text_width(line) <= cols or cols < 1:
+        return [line]
+    pieces = []
+    width = cols
+    while text_width(line) > width:
+        end = fit(line, width)
+        cut = line.rfind(' ', 0, end + 1)
+        if cut > 0:
+            pieces.append(line[:cut])
+            line = line[cut + 1:]
+        else:
+            pieces.append(line[:end])
+            line = line[end:]
+        width = max(cols - 1, 1)
+    pieces.append(line)
+    return pieces[:1] + ["\u21B3" + piece for piece in pieces[1:]]
+
 class Paragraph(tulip.VContainer):
+    """Text wrapped to the width it's rendered at, one Text per line.
+
+    Wrapped lines are cached for the last few widths and the Text children
+    are reused, so rendering at an unchanged width does no work and text
+    appended with append() only re-wraps the last line.
+    """
+
+    WRAP_CACHE_SIZE = 4
+
     def __init__(self, text=''):
         super().__init__()
         self._text = text
+        self._lines = text.split("\n")
+        self._wrapped = {}
+        self._flow_cols = None
         self.reflow(math.inf)
 
+    def _wrapped_lines(self, cols):
+        wrapped = self._wrapped.pop(cols, None)
+        if wrapped is None:
+            wrapped = [wrap(line, cols) for line in self._lines]
+            if len(self._wrapped) >= self.WRAP_CACHE_SIZE:
+                del self._wrapped[next(iter(self._wrapped))]
+        self._wrapped[cols] = wrapped
+        return wrapped
+
+    def _set_lines(self, lines, start=0):
+        """Makes children from the start-th one on display the given lines.
+        """
+
+        children = self._children
+        for child, line in zip(children[start:], lines):
+            child.set_text(line)
+        stop = start + len(lines)
+        if stop < len(children):
+            self._truncate_children(stop)
+        for line in lines[len(children) - start:]:
+            self.add_child(tulip.Text(line))
+
     def reflow(self, max_cols):
-        self.clear_children()
-        for line in self.text.split("\n"):
-            if len(line) <= max_cols:
-                self.add_child(tulip.Text(line))
-            else:
-                self.add_child(tulip.Text(line[:max_cols]))
-                self.add_child(tulip.Text("\u21B3" + line[max_cols:]))
+        wrapped = self._wrapped_lines(max_cols)
+        self._flow_cols = max_cols
+        self._set_lines([piece for pieces in wrapped for piece in pieces])
+
+    def append(self, text):
+        """Appends text, re-wrapping only the lines it affects.
+        """
+
+        first = len(self._lines) - 1
+        self._text += text
+        self._lines[first:] = (self._lines[first] + text).split("\n")
+        for cols, wrapped in self._wrapped.items():
+            wrapped[first:] = [wrap(line, cols) for line in self._lines[first:]]
+        wrapped = self._wrapped_lines(self._flow_cols)
+        start = sum(len(pieces) for pieces in wrapped[:first])
+        self._set_lines([piece for pieces in wrapped[first:] for piece in pieces], start)
 
     def _render(self, screen, y, x, i, j, rows, cols):
-        self.reflow(cols)
+        if cols != self._flow_cols:
+            self.reflow(cols)
         return super()._render(screen, y, x, i, j, rows, cols)
 
     @property
@@ -67,4 +135,6 @@ class Paragraph(tulip.VContainer):
     def text(self, text):
         if self._text != text:
             self._text = text
-            self.invalidate()
+            self._lines = text.split("\n")
+            self._wrapped.clear()
+            self.reflow(self._flow_cols)
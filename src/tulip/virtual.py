@@ -0,0 +1,149 @@
+import tulip
+from collections import OrderedDict
+from tulip.index import SizeIndex, UniformIndex
+
+class VirtualChildren:
+    """A read-only sequence of the children of a VirtualContainer which
+    materializes them as they're accessed.
+    """
+
+    def __init__(self, container):
+        self._container = container
+
+    def __len__(self):
+        return self._container.count()
+
+    def __getitem__(self, k):
+        n = len(self)
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(n))]
+        if k < 0:
+            k += n
+        if k < 0 or k >= n:
+            raise IndexError('child index out of range')
+        return self._container.child(k)
+
+    def __iter__(self):
+        for k in range(0, len(self)):
+            yield self._container.child(k)
+
+    def index(self, w):
+        return self._container.child_index(w)
+
+class VirtualContainer(tulip.VContainer):
+    """A VContainer whose children come from a data source and only exist when needed.
+
+    count() gives the number of children and make_widget(k) creates the k-th
+    of them. Only children which are rendered (or otherwise accessed) get
+    created, and at most cache_size of them are kept around.
+
+    Children are assumed to be one row high unless row_height(k) is given,
+    the actual heights are only used for placing the rendered children.
+    The width is cols if given, otherwise that of the widest child created
+    so far (the first MEASURE_ROWS children are created to measure it if
+    there are none yet). Likewise, focus navigation only knows about
+    focusable children which currently exist.
+    """
+
+    MEASURE_ROWS = 64
+
+    def __init__(self, count, make_widget, row_height = None, cache_size = 1024, cols = None):
+        super().__init__()
+        self.count = count
+        self.make_widget = make_widget
+        self.row_height = row_height
+        self.cache_size = cache_size
+        self.cols = cols
+        self._materialized = OrderedDict()
+        self._children = VirtualChildren(self)
+
+    def child(self, k):
+        w = self._materialized.get(k)
+        if w is not None:
+            self._materialized.move_to_end(k)
+            return w
+        w = self.make_widget(k)
+        w.parent = self
+        w._position = k
+        w._reparented()
+        self._materialized[k] = w
+        self._add_focusable(w._focusable_count)
+        if self._focus_index is not None and k < len(self._focus_index):
+            self._focus_index.update(k, w._focusable_count)
+        self._evict()
+        return w
+
+    def _evict(self):
+        for _ in range(0, len(self._materialized) - self.cache_size):
+            k, w = self._materialized.popitem(last=False)
+            if w is self._focused_child:
+                self._materialized[k] = w
+                continue
+            self._add_focusable(-w._focusable_count)
+            if self._focus_index is not None and k < len(self._focus_index):
+                self._focus_index.update(k, 0)
+            self._orphan((w,))
+
+    def add_child(self, child):
+        raise RuntimeError('children of a VirtualContainer come from its data source')
+
+    def insert_child(self, k, child):
+        self.add_child(child)
+
+    def remove_child(self, child):
+        self.add_child(child)
+
+    def clear_children(self):
+        self.reload()
+
+    def reload(self):
+        """Forgets all children, to be called when the data source changes.
+        """
+
+        for w in self._materialized.values():
+            self._add_focusable(-w._focusable_count)
+        self._orphan(self._materialized.values())
+        self._materialized.clear()
+        self._focused_child = None
+        self._index = None
+        self._focus_index = None
+        self.invalidate()
+
+    def _rendered_widget(self, k):
+        return self._materialized.get(k)
+
+    def _existing_children(self):
+        return [self._materialized[k] for k in sorted(self._materialized)]
+
+    def _focus_counts(self):
+        # counts of all children, 0 for those which don't exist
+        n = self.count()
+        if self._focus_index is None or len(self._focus_index) != n:
+            self._focus_index = SizeIndex.zeros(n)
+            for k, w in self._materialized.items():
+                if k < n:
+                    self._focus_index.update(k, w._focusable_count)
+        return self._focus_index
+
+    def child_invalidated(self, child):
+        # the index is built from row_height(), not from the children
+        tulip.Widget.child_invalidated(self, child)
+
+    def _size_index(self, b):
+        n = self.count()
+        if not self.row_height:
+            return UniformIndex(n)
+        if self._index is None or len(self._index) > n:
+            self._index = SizeIndex()
+        for k in range(len(self._index), n):
+            self._index.append(self.row_height(k))
+        return self._index
+
+    def _measure(self):
+        if self.cols is not None:
+            return (self._size_index(0).total, self.cols)
+        if not self._materialized:
+            for k in range(0, min(self.count(), self.MEASURE_ROWS, self.cache_size)):
+                self.child(k)
+        cols = max((w.size[1] for w in self._materialized.values()), default=0)
+        return (self._size_index(0).total, cols)
@@ -1,21 +1,49 @@
 import tulip
+from tulip.index import SizeIndex
 
 focusable_p = lambda w: w.focusable
 
+# interned tuples of resulting classes, so that equal ones are the same
+# object; only an optimization, so it's simply emptied when it grows too big
+_class_tuples = {}
+_CLASS_TUPLES_MAX = 4096
+
+# shared by all widgets without children (or classes) of their own
+NO_CHILDREN = ()
+NO_CLASSES = ()
+
 class Widget(tulip.KeypressMixin):
+    """The base of all widgets.
+
+    Widgets have __slots__, so that large trees stay small. Widgets without
+    children or classes share empty tuples rather than having lists.
+    """
+
+    __slots__ = (
+        'parent', '_position', '_children', '_focused_child', 'visible_start', 'visible_stop',
+        'render_args', 'rendered_size', '_focusable', '_focusable_count', '_focus_index',
+        '_classes', '_resulting_classes',
+        '_size', '_hidden', '_damage_pending',
+    )
+
     def __init__(self):
         super().__init__()
         self.parent = None
-        self._children = []
+        self._position = None # in parent's children
+        self._children = NO_CHILDREN
         self._focused_child = None
         self.visible_start = 0 # recalc on clear children!
         self.visible_stop = 0
         self.render_args = None
         self.rendered_size = (0, 0)
-        self.focusable = False
-        self._classes = []
+        self._focusable = False
+        self._focusable_count = 0 # in the subtree
+        self._focus_index = None # counts of children's subtrees
+        self._classes = NO_CLASSES
+        self._resulting_classes = None
         self._size = None
         self._hidden = False
+        self._damage_pending = False
 
     def __repr__(self):
         return "{} (size={})".format(self.__class__.__name__, self.size)
@@ -28,24 +56,127 @@ class Widget(tulip.KeypressMixin):
 
     def print_tree(self, indent = 0):
         tulip.print_indented(self, indent)
-        for child in self._children:
+        for child in self._existing_children():
             child.print_tree(indent + 1)
 
     def add_class(self, name):
+        if self._classes is NO_CLASSES:
+            self._classes = []
         self._classes.append(name)
-        self.invalidate()
+        self._forget_classes()
+        self.damage()
         return self
 
     def remove_class(self, name):
+        if name not in self._classes:
+            raise ValueError('{} has no class {}'.format(self, name))
         self._classes.remove(name)
-        self.invalidate()
+        self._forget_classes()
+        self.damage()
         return self
 
+    def _reparented(self):
+        self._forget_classes()
+
+    def _existing_children(self):
+        # children which exist, without creating any (see VirtualContainer)
+        return self._children
+
+    def _forget_classes(self):
+        """Forgets the cached resulting classes of the subtree.
+
+        A widget's tuple is only computed after its parent's, so the
+        subtrees of widgets which have no tuple have none either and are
+        skipped.
+        """
+
+        stack = [self]
+        while stack:
+            w = stack.pop()
+            if w._resulting_classes is not None or w is self:
+                w._resulting_classes = None
+                stack.extend(w._existing_children())
+
     @property
     def resulting_classes(self):
-        if not self.parent:
-            return self._classes
-        return self._classes + self.parent.resulting_classes
+        """Classes of the widget followed by classes of its predecessors, as an interned tuple.
+
+        The tuple is cached until classes of the widget or of its
+        predecessors change.
+        """
+
+        if self._resulting_classes is None:
+            path = []
+            w = self
+            while w and w._resulting_classes is None:
+                path.append(w)
+                w = w.parent
+            classes = w._resulting_classes if w else ()
+            if len(_class_tuples) > _CLASS_TUPLES_MAX:
+                _class_tuples.clear()
+            for w in reversed(path):
+                classes = tuple(w._classes) + classes
+                classes = w._resulting_classes = _class_tuples.setdefault(classes, classes)
+        return self._resulting_classes
+
+    @property
+    def focusable(self):
+        return self._focusable
+
+    @focusable.setter
+    def focusable(self, f):
+        f = bool(f)
+        if self._focusable != f:
+            self._focusable = f
+            self._add_focusable(1 if f else -1)
+
+    def _add_focusable(self, delta):
+        """Adds delta to the numbers of focusable widgets in the subtrees of
+        this widget and its predecessors.
+        """
+
+        w = self
+        while w:
+            w._focusable_count += delta
+            p = w.parent
+            if p and p._focus_index is not None:
+                p._focus_index.update(w._position, w._focusable_count)
+            w = p
+
+    def _focus_counts(self):
+        """Returns prefix sums of numbers of focusable widgets in the children's subtrees.
+        """
+
+        if self._focus_index is None:
+            self._focus_index = SizeIndex(c._focusable_count for c in self._children)
+        return self._focus_index
+
+    def _focusable_rank(self):
+        """Returns the number of focusable widgets before this one in pre-order, and the root.
+        """
+
+        r = 0
+        w = self
+        while w.parent:
+            p = w.parent
+            r += p._focus_counts().prefix(w._position) + p._focusable
+            w = p
+        return (r, w)
+
+    def _select_focusable(self, n):
+        """Returns the n-th (counting from 0) focusable widget of the subtree in pre-order.
+        """
+
+        if n < 0 or n >= self._focusable_count:
+            return None
+        w = self
+        while True:
+            if w._focusable:
+                if n == 0:
+                    return w
+                n -= 1
+            k, n = w._focus_counts().find(n)
+            w = w._children[k]
 
     @property
     def hidden(self):
@@ -79,7 +210,54 @@ class Widget(tulip.KeypressMixin):
         return self._size
 
     def invalidate(self):
+        # a widget which wasn't rendered, or was rendered empty, is repainted
+        # by the nearest predecessor which took up some space and all of whose
+        # predecessors did too (render_args of skipped subtrees are stale)
+        target = None
+        w = self
+        while True:
+            if w.render_args and w.rendered_size[0] and w.rendered_size[1]:
+                if target is None:
+                    target = w
+            else:
+                target = None
+            if not w.parent:
+                break
+            w = w.parent
+        if target is None and w.render_args:
+            target = w # the root, even if it was empty
+        if target and not target._damage_pending:
+            target._damage_pending = True
+            target.render_args[0].add_invalidated(target)
+        self._size = None
+        if self.parent:
+            self.parent.child_invalidated(self)
+
+    def child_invalidated(self, child):
         self._size = None
+        if self.parent:
+            self.parent.child_invalidated(self)
+
+    def damage(self):
+        """Marks the area this widget was last rendered to as damaged.
+        """
+
+        if self.render_args:
+            screen, y, x = self.render_args[0:3]
+            screen.damage(y, x, *self.rendered_size)
+
+    def _damage_invalidated(self):
+        # both where the widget was and where it (most likely) will be
+        self.damage()
+        screen, y, x, i, j, rows, cols = self.render_args
+        rows_, cols_ = self.size
+        screen.damage(y, x, min(max(rows_ - i, 0), rows), min(max(cols_ - j, 0), cols))
+        self._damage_pending = False
+
+    def _expected_size(self, i, j, rows, cols):
+        # the size the widget renders to, if it's the size it measures
+        size = self.size
+        return (min(max(size[0] - i, 0), rows), min(max(size[1] - j, 0), cols))
 
     def on_before_render(self):
         pass
@@ -88,19 +266,59 @@ class Widget(tulip.KeypressMixin):
         pass
 
     def render(self, screen, y, x, i, j, rows, cols):
-        self.render_args = (screen, y, x, i, j, rows, cols)
+        args = (screen, y, x, i, j, rows, cols)
+        repaint = screen.clip is not None
+        if repaint:
+            old_args, old_size = self.render_args, self.rendered_size
+            # a widget which was empty is checked against where it's going to be
+            area = old_size if old_size[0] and old_size[1] else self._size
+            if args == old_args and self._size is not None and not screen.is_damaged(y, x, *area) \
+                    and self._expected_size(i, j, rows, cols) == old_size:
+                return old_size # what's on the screen is still valid
+        self.render_args = args
         if not self._hidden:
             self.on_before_render()
             self.rendered_size = self._render(screen, y, x, i, j, rows, cols)
             self.on_after_render()
         else:
             self.rendered_size = (0, 0)
+        self._damage_pending = False
+        if repaint and (args != old_args or self.rendered_size != old_size):
+            if not old_args or not screen.is_covered(*old_args[1:3], *old_size) \
+                    or not screen.is_covered(y, x, *self.rendered_size):
+                screen.layout_changed = True
         return self.rendered_size
 
     def redraw(self):
         if self.render_args:
             return self.render(*self.render_args)
 
+    def repaint(self):
+        """Re-renders the parts of a rendered tree which were damaged since.
+
+        Call on the root. Only widgets which intersect the damaged rectangles
+        are rendered again. If that moves things around outside of the damage,
+        the whole tree is rendered instead.
+        """
+
+        if not self.render_args:
+            return None
+        screen = self.render_args[0]
+        for w in screen.invalidated:
+            if w._damage_pending:
+                w._damage_invalidated()
+        screen.invalidated.clear()
+        if screen.damaged:
+            screen.begin_repaint()
+            try:
+                self.render(*self.render_args)
+            finally:
+                screen.end_repaint()
+            if screen.layout_changed:
+                screen.clear()
+                self.render(*self.render_args)
+        return self.rendered_size
+
     def first_leaf(self):
         if self._children:
             return self._children[0].first_leaf()
@@ -190,10 +408,24 @@ class Widget(tulip.KeypressMixin):
     prev_visible_p = _make_walk_p(prev_visible)
 
     def next_focusable(self):
-        return self.next_p(focusable_p)
+        r, root = self._focusable_rank()
+        return root._select_focusable(r + self._focusable)
 
     def prev_focusable(self):
-        return self.prev_p(focusable_p)
+        r, root = self._focusable_rank()
+        return root._select_focusable(r - 1)
+
+    def jump_focusable(self, n):
+        """Returns the focusable widget n focusable widgets after this one
+        (before it if n is negative), or the last (first) one if there
+        aren't that many.
+        """
+
+        r, root = self._focusable_rank()
+        if n > 0 and not self._focusable:
+            n -= 1 # the next one is the first step
+        r = max(0, min(r + n, root._focusable_count - 1))
+        return root._select_focusable(r)
 
     def first_focusable(self):
         if self.focusable:
@@ -240,7 +472,7 @@ class Widget(tulip.KeypressMixin):
 
     def subtree(self):
         yield self
-        for c in self._children:
+        for c in self._existing_children():
             yield from c.subtree()
 
     def srch(self, cls, once_per_subtree=False):
@@ -248,7 +480,7 @@ class Widget(tulip.KeypressMixin):
             yield self
             if once_per_subtree:
                 return
-        for w in self._children:
+        for w in self._existing_children():
             yield from w.srch(cls, once_per_subtree)
 
     def on_got_focus(self):
@@ -293,6 +525,8 @@ class Widget(tulip.KeypressMixin):
         return None
 
 class Air(Widget):
+    __slots__ = ('rows', 'cols')
+
     def __init__(self, rows, cols):
         super().__init__()
         self.rows = rows
@@ -305,5 +539,7 @@ class Air(Widget):
         return (self.rows, self.cols)
 
 class Empty(Air):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(0, 0)
@@ -0,0 +1,94 @@
+import unicodedata
+from functools import lru_cache
+
+ZWJ = '\u200d'
+
+@lru_cache(maxsize=65536)
+def char_width(ch):
+    """Returns the number of columns ch takes on a terminal: 0 for combining
+    marks and format characters, 2 for East Asian wide and full-width ones.
+    """
+
+    if unicodedata.combining(ch) or unicodedata.category(ch) in ('Mn', 'Me', 'Cf'):
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+
+def clusters(text):
+    """Yields the (cluster, width) pairs of text.
+
+    Grapheme clusters are approximated: a cluster is a character followed by
+    the zero-width characters which modify it, and a character following a
+    zero-width joiner joins the cluster before it (as in emoji sequences).
+    Zero-width characters at the start of text have nothing to attach to and
+    are yielded as clusters of width 0.
+    """
+
+    start = 0
+    width = None
+    joined = False
+    for k, ch in enumerate(text):
+        w = char_width(ch)
+        if width is not None and (w == 0 or joined):
+            joined = ch == ZWJ
+            continue
+        if k > start:
+            yield (text[start:k], width or 0)
+        start, width, joined = k, w, ch == ZWJ
+    if start < len(text):
+        yield (text[start:], width or 0)
+
+@lru_cache(maxsize=4096)
+def _text_width(text):
+    return sum(w for _, w in clusters(text))
+
+def text_width(text):
+    """Returns the number of columns text takes. Plain ASCII text is
+    measured by its length, other text is measured once and cached.
+    """
+
+    if text.isascii():
+        return len(text)
+    return _text_width(text)
+
+def clip(text, j, cols):
+    """Returns the part of text in columns j to j + cols. A wide character
+    cut by either edge is replaced by a space for each column it keeps.
+    """
+
+    if text.isascii():
+        return text[j:j + cols]
+    if j == 0 and _text_width(text) <= cols:
+        return text
+    return _clip(text, j, cols)
+
+@lru_cache(maxsize=4096)
+def _clip(text, j, cols):
+    end = j + cols
+    pieces = []
+    x = 0
+    for cluster, w in clusters(text):
+        if x >= end:
+            break
+        x1 = x + w
+        if j <= x and x1 <= end:
+            pieces.append(cluster)
+        elif x < end and x1 > j:
+            pieces.append(' ' * (min(x1, end) - max(x, j)))
+        x = x1
+    return ''.join(pieces)
+
+def fit(text, cols):
+    """Returns the length of the longest prefix of text at most cols wide,
+    but at least one cluster long.
+    """
+
+    if text.isascii():
+        return cols
+    k = 0
+    x = 0
+    for cluster, w in clusters(text):
+        x += w
+        if x > cols and k > 0:
+            break
+        k += len(cluster)
+    return k